@@ -1,282 +1,596 @@
 import io
 import os
+import json
 import time
 import sqlite3
 from typing import List, Tuple
 
-from flask import Flask, jsonify, request
+from flask import Flask, Response, g, jsonify, make_response, request, stream_with_context
 from flask_cors import CORS
 from PIL import Image
 import numpy as np
 
 from model import (
-    predict_topk,
-    compute_heatmap_overlay,
-    get_embedding,
-    pca2d,
     pil_to_base64_datauri,
+    encode_image,
     make_thumb,
     new_prediction_id,
-    class_names,
     MODEL_NAME,
+    canonical_model_name,
+    preload_models,
+    model_status,
+    loaded_models,
+    backend_reports,
+    infer_stack,
+    decode_image,
+    input_resize_side,
+    MODEL_PRELOAD,
+    DECODE_MIN_SIDE,
     get_stack,
-    predict_topk_stack,
-    compute_heatmap_overlay_stack,
-    get_embedding_stack,
+    explain_stack,
+    run_explain_batch,
+    batcher_depths,
+    run_infer_batch,
+    prepare_batch,
+    heatmap_overlay_from_cam,
+    cam_to_grid,
 )
+from projection import get_projector
+from storage import (
+    init_db,
+    insert_predictions,
+    update_emb2d,
+    clear_emb2d_before,
+    update_feedback,
+    metrics_counts,
+    last_n_embeddings,
+    get_group,
+    get_predictions,
+    get_thumb,
+    embedding_points,
+    most_common_group,
+    embedding_matrix,
+    iter_group_embeddings,
+)
+from vector_index import VectorIndex, get_index, max_items_for
+from result_cache import result_cache, image_key
+from jobs import Job, QueueFull, jobs
+from inference_pool import INFER_PROCESSES, active_pool, start_pool
+from export import PARTS as EXPORT_PARTS, Export
+from retention import start_compactor, status as retention_status
+from perf import gauge_labels, maybe_profile, observe, register_gauge, render_prometheus, span
 
 
-DB_PATH = os.environ.get('DB_PATH', 'data.db')
 EMBED_WINDOW = int(os.environ.get('EMBED_WINDOW', '200'))
+# /analyze/batch: max images per request and images per batched forward
+ANALYZE_BATCH_MAX = int(os.environ.get('ANALYZE_BATCH_MAX', '64'))
+ANALYZE_BATCH_CHUNK = max(1, int(os.environ.get('ANALYZE_BATCH_CHUNK', '8')))
+# Retry-After seconds sent when the async job queue is full
+JOB_RETRY_AFTER = int(os.environ.get('JOB_RETRY_AFTER', '5'))
+
+
+def refresh_projection(model: str | None, dim: int, n: int = EMBED_WINDOW) -> Tuple[List[sqlite3.Row], np.ndarray]:
+    """Re-fit the (model, dim) PCA basis over the last `n` rows and store
+    their 2D coords. Returns the rows (with updated coords) and the [N, 2] array."""
+    proj = get_projector(model, dim)
+    with proj.lock:
+        rows, X = last_n_embeddings(n, model, dim)
+        if not rows:
+            return rows, np.zeros((0, 2))
+        anchor = np.array([
+            (r['emb2d_x'], r['emb2d_y']) if r['emb2d_x'] is not None and r['emb2d_y'] is not None else (np.nan, np.nan)
+            for r in rows
+        ], dtype=float)
+        Z = proj.fit(X, anchor=anchor)
+        update_emb2d([r['id'] for r in rows], Z)
+        # Older rows still hold coords from the previous basis
+        clear_emb2d_before(model, dim, rows[0]['timestamp'])
+    rows = [dict(r, emb2d_x=float(z[0]), emb2d_y=float(z[1])) for r, z in zip(rows, Z)]
+    return rows, Z
+
+
+def fill_missing_coords(rows: List[sqlite3.Row], X: np.ndarray, model: str | None, dim: int, n: int = EMBED_WINDOW):
+    """Project rows that have no 2D coords yet with the current basis,
+    fitting one over the last `n` rows first if this group has none."""
+    missing = [i for i, r in enumerate(rows) if r['emb2d_x'] is None or r['emb2d_y'] is None]
+    if not missing:
+        return rows
+    proj = get_projector(model, dim)
+    with proj.lock:
+        if not proj.fitted:
+            refresh_projection(model, dim, n)
+        if not proj.fitted:
+            return rows
+        Z = proj.transform(X[missing])
+        update_emb2d([rows[i]['id'] for i in missing], Z)
+    rows = list(rows)
+    for i, z in zip(missing, Z):
+        rows[i] = dict(rows[i], emb2d_x=float(z[0]), emb2d_y=float(z[1]))
+    return rows
+
+
+def group_index(model: str | None, dim: int) -> VectorIndex:
+    # Built lazily from the full history of this (model, dim) group
+    return get_index(model, dim, loader=lambda: iter_group_embeddings(model, dim, max_items_for(dim)))
+
+
+def build_neighbors(pid: str, k: int = 5, embedding: np.ndarray | None = None,
+                    group: Tuple[str | None, int] | None = None):
+    """Nearest neighbors of `pid` by cosine similarity over the full embeddings
+    of every stored prediction from the same model, via the in-process index."""
+    if group is None:
+        group = get_group(pid)
+        if group is None:
+            return []
+    model, dim = group
+    if embedding is None:
+        me = get_predictions([pid]).get(pid)
+        if me is None:
+            return []
+        embedding = embedding_matrix([me['embedding_f32']], dim)[0]
+
+    hits = group_index(model, dim).search(embedding, k=k, exclude=pid)
+    found = get_predictions([hid for hid, _ in hits])
+    rows = [found[hid] for hid, _ in hits if hid in found]
+    if not rows:
+        return []
+    # Older rows may predate the current basis; project them on the fly
+    rows = fill_missing_coords(rows, embedding_matrix([r['embedding_f32'] for r in rows], dim), model, dim)
+    return [
+        {
+            'x': float(r['emb2d_x']),
+            'y': float(r['emb2d_y']),
+            'thumb_id': r['thumb_id'],
+            'thumb_url': f"/thumbs/{r['thumb_id']}" if r['thumb_id'] else None,
+            'label': r['predicted_label'],
+        }
+        for r in rows
+    ]
 
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-    conn.row_factory = sqlite3.Row
-    return conn
-
-
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        """
-        CREATE TABLE IF NOT EXISTS predictions (
-            id TEXT PRIMARY KEY,
-            predicted_label TEXT,
-            predicted_prob REAL,
-            timestamp REAL,
-            user TEXT,
-            true_label TEXT,
-            embedding TEXT,
-            emb2d_x REAL,
-            emb2d_y REAL,
-            thumb_b64 TEXT
-        )
-        """
-    )
-    conn.commit()
-    conn.close()
-
-
-def insert_prediction(
-    pid: str,
-    label: str,
-    prob: float,
-    embedding: np.ndarray,
-    emb2d: Tuple[float, float] | None,
-    thumb_b64: str,
-    user: str | None = None,
-):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute(
-        "INSERT INTO predictions (id, predicted_label, predicted_prob, timestamp, user, true_label, embedding, emb2d_x, emb2d_y, thumb_b64) VALUES (?,?,?,?,?,?,?,?,?,?)",
-        (
-            pid,
-            label,
-            float(prob),
-            time.time(),
-            user or 'demo',
-            None,
-            ','.join(map(str, embedding.tolist())),
-            float(emb2d[0]) if emb2d else None,
-            float(emb2d[1]) if emb2d else None,
-            thumb_b64,
-        ),
-    )
-    conn.commit()
-    conn.close()
+def compute_confusion_and_counts(model: str | None = None, since: float | None = None,
+                                 until: float | None = None, top: int = 5):
+    """Prediction counts and a confusion matrix over the top classes, from the
+    metrics rollup (cost grows with the number of classes, not rows)."""
+    cells = metrics_counts(model, since, until)
+    counts = {}
+    true_counts = {}
+    for pred, true, n in cells:
+        counts[pred] = counts.get(pred, 0) + n
+        if true:
+            true_counts[true] = true_counts.get(true, 0) + n
+    # Build class list from most common up to `top`
+    classes = [lbl for lbl, _ in sorted(counts.items(), key=lambda x: -x[1])[:top]]
+    # Add any true labels present but not in top preds, up to `top`
+    for tl, _ in sorted(true_counts.items(), key=lambda x: -x[1]):
+        if len(classes) >= top:
+            break
+        if tl not in classes:
+            classes.append(tl)
+    m = len(classes)
+    idx = {c: i for i, c in enumerate(classes)}
+    conf = [[0 for _ in range(m)] for _ in range(m)]
+    for pred, true, n in cells:
+        if true in idx and pred in idx:
+            conf[idx[true]][idx[pred]] += n
+    return counts, conf, classes
 
 
-def update_emb2d(ids: List[str], coords: np.ndarray):
-    conn = get_db()
-    cur = conn.cursor()
-    for pid, (x, y) in zip(ids, coords):
-        cur.execute("UPDATE predictions SET emb2d_x=?, emb2d_y=? WHERE id=?", (float(x), float(y), pid))
-    conn.commit()
-    conn.close()
+app = Flask(__name__)
+CORS(app)
+if INFER_PROCESSES > 0:
+    # Load synchronously and fork the inference workers before any other threads start
+    start_pool([canonical_model_name(n) for n in (MODEL_PRELOAD or [MODEL_NAME])])
+else:
+    preload_models()
+init_db()
+start_compactor()
 
 
-def update_feedback(pid: str, true_label: str):
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("UPDATE predictions SET true_label=? WHERE id=?", (true_label, pid))
-    conn.commit()
-    conn.close()
+@app.before_request
+def _start_timer():
+    g.t0 = time.perf_counter()
 
 
-def last_n_predictions(n: int) -> List[sqlite3.Row]:
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM predictions ORDER BY timestamp DESC LIMIT ?", (n,))
-    rows = cur.fetchall()
-    conn.close()
-    return list(reversed(rows))  # chronological order
+@app.after_request
+def _record_request(resp):
+    # Streaming responses (NDJSON, SSE) are timed up to their first byte
+    if getattr(g, 't0', None) is not None and request.endpoint:
+        observe('request', time.perf_counter() - g.t0, endpoint=request.endpoint, status=resp.status_code)
+    return resp
 
 
-def _parse_embedding_str(s: str) -> np.ndarray:
-    return np.array(list(map(float, s.split(','))), dtype=float)
+def _cache_stats():
+    total = result_cache.hits + result_cache.misses
+    return {
+        gauge_labels(kind='hits'): result_cache.hits,
+        gauge_labels(kind='misses'): result_cache.misses,
+        gauge_labels(kind='hit_rate'): (result_cache.hits / total) if total else 0.0,
+    }
 
 
-def _emb_len(row: sqlite3.Row) -> int:
-    try:
-        return len(row['embedding'].split(',')) if row['embedding'] else 0
-    except Exception:
-        return 0
+def _queue_depths():
+    depths = {gauge_labels(queue='jobs'): jobs.qsize()}
+    for name, n in batcher_depths().items():
+        depths[gauge_labels(queue='batcher', model=name)] = n
+    pool = active_pool()
+    if pool is not None:
+        depths[gauge_labels(queue='infer_idle_workers')] = pool.idle()
+    return depths
 
 
-def build_neighbors(pid: str, k: int = 5):
-    rows = last_n_predictions(EMBED_WINDOW)
-    row_map = {r['id']: r for r in rows}
-    me = row_map.get(pid)
-    if me is None:
-        return []
+register_gauge('mlx_result_cache', _cache_stats, 'Analyze result cache hits, misses and hit rate.')
+register_gauge('mlx_queue_depth', _queue_depths, 'Work waiting in each queue (idle workers for the inference pool).')
+register_gauge('mlx_models_loaded_bytes', lambda: {gauge_labels(model=k): v for k, v in loaded_models().items()},
+               'Weight bytes of each loaded model.')
 
-    target_dim = _emb_len(me)
-    rows_dim = [r for r in rows if _emb_len(r) == target_dim]
-    if len(rows_dim) == 0:
-        return []
 
-    # If any missing coords among this dimension subset, recompute PCA just for them
-    if any(r['emb2d_x'] is None or r['emb2d_y'] is None for r in rows_dim):
-        vecs = [_parse_embedding_str(r['embedding']) for r in rows_dim]
-        Z = pca2d(vecs)
-        update_emb2d([r['id'] for r in rows_dim], Z)
-        rows = last_n_predictions(EMBED_WINDOW)
-        row_map = {r['id']: r for r in rows}
-        rows_dim = [row_map[r['id']] for r in rows_dim if r['id'] in row_map]
-
-    # Build neighbor list within same-dimension subset
-    idx_map = {r['id']: i for i, r in enumerate(rows_dim)}
-    i = idx_map.get(pid)
-    if i is None:
-        return []
-    xs = np.array([r['emb2d_x'] for r in rows_dim], dtype=float)
-    ys = np.array([r['emb2d_y'] for r in rows_dim], dtype=float)
-    dx = xs - xs[i]
-    dy = ys - ys[i]
-    dist = np.sqrt(dx * dx + dy * dy)
-    order = np.argsort(dist)
+@app.route("/")
+def index():
+    return "ml-explainer backend is running."
+
+
+@app.get('/health')
+def health():
+    return jsonify({'ok': True})
+
+
+@app.get('/ready')
+def ready():
+    # Ready once every preloaded model has loaded; an LRU eviction doesn't count
+    # against it since the model reloads on demand. With lazy loading nothing
+    # loads before the first request, so only a load in progress or a failed
+    # load of the default model reports not ready.
+    status = model_status()
+    required = [canonical_model_name(n) for n in MODEL_PRELOAD]
+    if required:
+        is_ready = all(status.get(n) in ('ready', 'evicted') for n in required)
+    else:
+        state = status.get(canonical_model_name(MODEL_NAME)) or ''
+        # Load failures are reported as 'error: <reason>'
+        is_ready = state != 'loading' and not state.startswith('error')
+    pool = active_pool()
+    return jsonify({
+        'ready': is_ready,
+        'models': status,
+        'backends': backend_reports(),
+        'infer_processes': {'workers': pool.alive, 'models': sorted(pool.names)} if pool is not None else None,
+        'retention': retention_status(),
+    }), (200 if is_ready else 503)
+
+
+def select_stack(req_model: str | None) -> Tuple[str, dict]:
+    """Requested model stack, falling back to the default model on unknown names or load errors."""
+    model_name = canonical_model_name(req_model or MODEL_NAME)
+    try:
+        return model_name, get_stack(model_name)
+    except Exception:
+        model_name = canonical_model_name(MODEL_NAME)
+        return model_name, get_stack(model_name)
+
+
+def explain_images(stack: dict, model_name: str, pils: List[Image.Image], want_heatmap: bool = True,
+                   heatmap_format: str = 'png', batched: bool = False, cam_classes: int = 1) -> List[dict]:
+    """Top-k, embedding and heatmap payload per image, consulting the result cache.
+
+    With `batched`, cache misses run through the model as one real batch;
+    otherwise each goes through explain_stack (and the shared micro-batcher).
+    heatmap=False skips Grad-CAM and uses the stack's fast inference backend.
+    In grid format, `cam_classes` > 1 returns stacked CAMs for that many top-k
+    classes, all from the same forward pass.
+    """
+    if not want_heatmap:
+        if batched:
+            results = run_infer_batch(stack, prepare_batch(stack, pils), k=5)
+        else:
+            results = [infer_stack(stack, pil, k=5) for pil in pils]
+        return [
+            {'topk': r['topk'], 'embedding': r['embedding'], 'heatmap_png_b64': None, 'heatmap_grid': None, 'cached': False}
+            for r in results
+        ]
+
+    # Repeat uploads of the same pixels under the same model skip inference
+    cam_classes = max(1, min(cam_classes, 5)) if heatmap_format == 'grid' else 1
+    keys = [image_key(pil, model_name) if result_cache.enabled else None for pil in pils]
+    entries = [result_cache.get(k) if k else None for k in keys]
+    # An entry without enough per-class CAMs is recomputed (keeping its rendered PNG)
+    cached = [
+        e if e is not None and (cam_classes == 1 or (e.get('cams') is not None and len(e['cams']) >= cam_classes)) else None
+        for e in entries
+    ]
+    misses = [i for i, c in enumerate(cached) if c is None]
+    fresh: dict = {}
+    with span('explain', model=model_name):
+        if misses and batched:
+            # Top-k, Grad-CAM and embedding from one forward/backward pass over the batch
+            x = prepare_batch(stack, [pils[i] for i in misses])
+            for i, r in zip(misses, run_explain_batch(stack, x, k=5, cam_k=cam_classes)):
+                fresh[i] = r
+        else:
+            for i in misses:
+                fresh[i] = explain_stack(stack, pils[i], k=5, cam_k=cam_classes)
+
     out = []
-    for j in order:
-        if rows_dim[j]['id'] == pid:
-            continue
+    for i, pil in enumerate(pils):
+        src = cached[i] if cached[i] is not None else fresh[i]
+        topk, emb, cam, cams = src['topk'], src['embedding'], src['cam'], src.get('cams')
+        cached_png = entries[i].get('heatmap_png_b64') if entries[i] is not None else None
+        heat_b64, heat_grid = None, None
+        if heatmap_format == 'grid':
+            with span('heatmap_grid', model=model_name):
+                heat_grid = cam_to_grid(cams[:cam_classes] if cam_classes > 1 else cam, image_size=pil.size)
+        elif cached_png is not None:
+            heat_b64 = cached_png
+        else:
+            # Heatmap (transparent overlay)
+            with span('heatmap_png', model=model_name):
+                heat = heatmap_overlay_from_cam(cam, pil.size, overlay_alpha=0.9)
+                heat_b64 = pil_to_base64_datauri(heat, fmt='PNG')
+        if keys[i] and (cached[i] is None or (heat_b64 is not None and cached_png is None)):
+            result_cache.put(keys[i], {
+                'topk': topk, 'embedding': emb, 'cam': cam, 'cams': cams, 'heatmap_png_b64': heat_b64 or cached_png,
+            })
         out.append({
-            'x': float(xs[j]),
-            'y': float(ys[j]),
-            'thumb': rows_dim[j]['thumb_b64'],
-            'label': rows_dim[j]['predicted_label'],
+            'topk': topk, 'embedding': emb, 'heatmap_png_b64': heat_b64, 'heatmap_grid': heat_grid,
+            'cached': cached[i] is not None,
         })
-        if len(out) >= k:
-            break
     return out
 
 
-def compute_confusion_and_counts(n: int = 200):
-    rows = last_n_predictions(n)
-    counts = {}
-    for r in rows:
-        counts[r['predicted_label']] = counts.get(r['predicted_label'], 0) + 1
-    # Build class list from most common up to 5
-    classes = [lbl for lbl, _ in sorted(counts.items(), key=lambda x: -x[1])[:5]]
-    # Add any true labels present but not in top preds, up to 5
-    for r in rows:
-        tl = r['true_label']
-        if tl and tl not in classes and len(classes) < 5:
-            classes.append(tl)
-    m = len(classes)
-    idx = {c: i for i, c in enumerate(classes)}
-    conf = [[0 for _ in range(m)] for _ in range(m)]
-    for r in rows:
-        if r['true_label']:
-            tr = r['true_label']
-            pr = r['predicted_label']
-            if tr in idx and pr in idx:
-                conf[idx[tr]][idx[pr]] += 1
-    return counts, conf, classes
-
-
-app = Flask(__name__)
-CORS(app)
-init_db()
-
+def store_predictions(model_name: str, pils: List[Image.Image], results: List[dict], user: str | None,
+                      pids: List[str] | None = None) -> List[dict]:
+    """Persist results in one bulk insert and place them in the 2D projection.
+
+    New points are projected with the current PCA basis in O(dim); the window
+    (including these rows) is re-fitted once only when the basis is missing or
+    stale. Also keeps an already-built neighbor index current. Returns
+    {'id', 'emb2d'} per result.
+    """
+    pids = pids or [new_prediction_id() for _ in results]
+    embs = np.stack([np.asarray(r['embedding'], dtype=np.float32) for r in results], axis=0)
+    dim = int(embs.shape[1])
+    proj = get_projector(model_name, dim)
+    with proj.lock:
+        coords: List[Tuple[float, float] | None] = [None] * len(results)
+        if proj.fitted:
+            with span('pca_transform', model=model_name):
+                Z = proj.transform(embs)
+            if not proj.needs_refit(Z):
+                coords = [(float(z[0]), float(z[1])) for z in Z]
+        with span('thumb_encode', model=model_name):
+            thumbs = [encode_image(make_thumb(pil), fmt='JPEG') for pil in pils]
+        with span('db_insert', model=model_name):
+            insert_predictions([
+                dict(
+                    pid=pid,
+                    label=r['topk'][0][0],
+                    prob=r['topk'][0][1],
+                    embedding=emb,
+                    emb2d=xy,
+                    thumb=thumb,
+                    user=user,
+                    model=model_name,
+                )
+                for pid, r, emb, xy, thumb in zip(pids, results, embs, coords, thumbs)
+            ])
+        if coords[0] is None:
+            with span('pca_refit', model=model_name):
+                rows, _ = refresh_projection(model_name, dim)
+            by_id = {r['id']: (float(r['emb2d_x']), float(r['emb2d_y'])) for r in rows}
+            missing = [i for i, pid in enumerate(pids) if pid not in by_id]
+            if missing:
+                # More rows than the window: project the rest with the fresh basis
+                Z = proj.transform(embs[missing])
+                update_emb2d([pids[i] for i in missing], Z)
+                by_id.update({pids[i]: (float(z[0]), float(z[1])) for i, z in zip(missing, Z)})
+            coords = [by_id[pid] for pid in pids]
+    # Keep an already-built index current; otherwise it loads these rows from the DB
+    with span('index_add', model=model_name):
+        group_index(model_name, dim).add(pids, embs)
+    return [{'id': pid, 'emb2d': xy, 'dim': dim} for pid, xy in zip(pids, coords)]
+
+
+def heatmap_classes_param() -> int:
+    # heatmap_classes=N (grid format): CAMs for the top N classes, stacked in heatmap_grid
+    try:
+        return max(1, min(5, int(request.form.get('heatmap_classes', '1'))))
+    except ValueError:
+        return 1
+
+
+def analysis_response(model_name: str, result: dict, stored: dict) -> dict:
+    with span('neighbors', model=model_name):
+        neighbors = build_neighbors(stored['id'], k=5, embedding=result['embedding'], group=(model_name, stored['dim']))
+    return {
+        'topk': [{'label': l, 'p': p} for l, p in result['topk']],
+        'heatmap_png_b64': result['heatmap_png_b64'],
+        'heatmap_grid': result['heatmap_grid'],
+        'embedding': {'x': stored['emb2d'][0], 'y': stored['emb2d'][1]},
+        'neighbors': neighbors,
+        'id': stored['id'],
+        'model': f'{model_name}@torchvision',
+        'cached': result['cached'],
+    }
 
-@app.route("/")
-def index():
-    return "ml-explainer backend is running."
 
+def run_analysis_job(job: Job, req_model: str | None, data: bytes, want_heatmap: bool,
+                     heatmap_format: str, user: str | None, cam_classes: int = 1):
+    """Worker side of async /analyze: model load and decode, top-k and heatmap,
+    then storage and neighbors.
+
+    A model that isn't in memory yet is announced with a `loading` event and
+    loaded here, not in the request. One explain pass yields top-k and
+    heatmap, so the published top-k is the one that was explained and
+    stored, and the model runs once per job.
+    """
+    model_name = canonical_model_name(req_model or MODEL_NAME)
+    if model_name not in loaded_models():
+        job.publish('loading', {'model': f'{model_name}@torchvision'})
+    model_name, stack = select_stack(req_model)
+    job.check_cancelled()
+    pil = decode_image(io.BytesIO(data), min_side=max(DECODE_MIN_SIDE, input_resize_side(stack)))
+    result = explain_images(stack, model_name, [pil], want_heatmap=want_heatmap, heatmap_format=heatmap_format,
+                            cam_classes=cam_classes)[0]
+    job.publish('topk', {
+        'topk': [{'label': l, 'p': p} for l, p in result['topk']],
+        'model': f'{model_name}@torchvision',
+    }, status='running')
+    if want_heatmap:
+        job.publish('heatmap', {
+            'heatmap_png_b64': result['heatmap_png_b64'],
+            'heatmap_grid': result['heatmap_grid'],
+            'cached': result['cached'],
+        })
 
-@app.get('/health')
-def health():
-    return jsonify({'ok': True})
+    # Nothing is stored for a job cancelled before this point
+    job.check_cancelled()
+    stored = store_predictions(model_name, [pil], [result], user, pids=[job.id])[0]
+    resp = analysis_response(model_name, result, stored)
+    job.publish('neighbors', {'embedding': resp['embedding'], 'neighbors': resp['neighbors']})
 
 
 @app.post('/analyze')
 def analyze():
+    # X-Profile: 1 (or PROFILE_SAMPLE_RATE sampling) records a torch.profiler trace of this request
+    with maybe_profile(f'analyze-{int(time.time() * 1000)}', requested=request.headers.get('X-Profile') == '1') as trace:
+        resp = make_response(_analyze())
+    if trace:
+        resp.headers['X-Profile-Trace'] = os.path.basename(trace)
+    return resp
+
+
+def _analyze():
     if 'image' not in request.files:
         return jsonify({'error': 'image file missing'}), 400
     file = request.files['image']
-    pil = Image.open(file.stream).convert('RGB')
-
     # Optional per-request model selection
-    req_model = (request.form.get('model') or request.headers.get('X-Model') or MODEL_NAME).lower()
+    req_model = request.form.get('model') or request.headers.get('X-Model')
+
+    # heatmap=0 skips Grad-CAM and serves top-k/embedding from the stack's fast backend;
+    # heatmap_format=grid returns the raw CAM grid for client-side colorizing instead of a PNG
+    want_heatmap = request.form.get('heatmap', '1') != '0'
+    heatmap_format = (request.form.get('heatmap_format') or 'png').lower()
+    cam_classes = heatmap_classes_param()
+    user = request.headers.get('X-User') or None
+
+    if request.form.get('async', '0') == '1':
+        # Queue the work and answer right away; results arrive via /jobs/<id>.
+        # Only the upload bytes are read here: a cold model load runs in the job
+        data = file.read()
+        pid = new_prediction_id()
+        try:
+            jobs.submit(pid, lambda job: run_analysis_job(job, req_model, data, want_heatmap, heatmap_format, user, cam_classes))
+        except QueueFull:
+            resp = jsonify({'error': 'analysis queue is full, retry shortly'})
+            resp.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+            return resp, 503
+        return jsonify({
+            'id': pid,
+            'status': 'queued',
+            'poll': f'/jobs/{pid}',
+            'events': f'/jobs/{pid}/events',
+        }), 202
+
+    model_name, stack = select_stack(req_model)
+    # Decode once, downscaled in the JPEG decoder to what the model/overlay/thumb need
+    pil = decode_image(file.stream, min_side=max(DECODE_MIN_SIDE, input_resize_side(stack)))
+    result = explain_images(
+        stack, model_name, [pil], want_heatmap=want_heatmap, heatmap_format=heatmap_format, cam_classes=cam_classes,
+    )[0]
+    stored = store_predictions(model_name, [pil], [result], user)[0]
+    return jsonify(analysis_response(model_name, result, stored))
+
+
+@app.get('/jobs/<job_id>')
+def job_status(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    return jsonify(job.snapshot())
+
+
+@app.delete('/jobs/<job_id>')
+def job_cancel(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
+    job.cancel()
+    return jsonify({'id': job.id, 'status': job.status})
+
+
+@app.get('/jobs/<job_id>/events')
+def job_events(job_id):
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'unknown job'}), 404
     try:
-        stack = get_stack(req_model)
-        model_name = req_model
-    except Exception:
-        stack = get_stack(MODEL_NAME)
-        model_name = MODEL_NAME
-
-    # Top-k
-    topk = predict_topk_stack(stack, pil, k=5)
-
-    # Heatmap (transparent overlay)
-    heat = compute_heatmap_overlay_stack(stack, pil, overlay_alpha=0.9)
-    heat_b64 = pil_to_base64_datauri(heat, fmt='PNG')
-
-    # Embedding
-    emb = get_embedding_stack(stack, pil)
-
-    # Update PCA on window
-    pid = new_prediction_id()
-    thumb = make_thumb(pil)
-    thumb_b64 = pil_to_base64_datauri(thumb, fmt='JPEG')
-
-    # Insert first to ensure it's available for window PCA
-    insert_prediction(
-        pid=pid,
-        label=topk[0][0],
-        prob=topk[0][1],
-        embedding=emb,
-        emb2d=None,
-        thumb_b64=thumb_b64,
-        user=request.headers.get('X-User') or None,
-    )
-
-    # Recompute PCA for last window (including this one), but only for rows with same embedding dim
-    rows = last_n_predictions(EMBED_WINDOW)
-    target_dim = len(emb)
-    rows_dim = [r for r in rows if _emb_len(r) == target_dim]
-    if len(rows_dim) >= 1:
-        vecs = [_parse_embedding_str(r['embedding']) for r in rows_dim]
-        Z = pca2d(vecs)
-        update_emb2d([r['id'] for r in rows_dim], Z)
-    # Fetch updated row for self
-    rows = last_n_predictions(EMBED_WINDOW)
-    row_map = {r['id']: r for r in rows}
-    me = row_map[pid]
-    neighbors = build_neighbors(pid, k=5)
-
-    resp = {
-        'topk': [{'label': l, 'p': p} for l, p in topk],
-        'heatmap_png_b64': heat_b64,
-        'embedding': {'x': float(me['emb2d_x']), 'y': float(me['emb2d_y'])},
-        'neighbors': neighbors,
-        'id': pid,
-        'model': f'{model_name}@torchvision',
-    }
-    return jsonify(resp)
+        # Reconnecting EventSource clients resume after the last event they saw
+        seq = int(request.headers.get('Last-Event-ID', '-1')) + 1
+    except ValueError:
+        seq = 0
+
+    def generate():
+        nonlocal seq
+        while True:
+            events = job.events_since(seq, timeout=15.0)
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for i, event, data in events:
+                yield f'id: {i}\nevent: {event}\ndata: {json.dumps(data)}\n\n'
+                seq = i + 1
+            if job.finished and seq >= len(job.events):
+                return
+
+    resp = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+
+@app.post('/analyze/batch')
+def analyze_batch():
+    files = request.files.getlist('images') or request.files.getlist('image')
+    if not files:
+        return jsonify({'error': 'images missing'}), 400
+    if len(files) > ANALYZE_BATCH_MAX:
+        return jsonify({'error': f'at most {ANALYZE_BATCH_MAX} images per request'}), 413
+
+    model_name, stack = select_stack(request.form.get('model') or request.headers.get('X-Model'))
+    want_heatmap = request.form.get('heatmap', '1') != '0'
+    heatmap_format = (request.form.get('heatmap_format') or 'png').lower()
+    cam_classes = heatmap_classes_param()
+    user = request.headers.get('X-User') or None
+    min_side = max(DECODE_MIN_SIDE, input_resize_side(stack))
+
+    def generate():
+        # Each chunk is one batched forward/backward, one bulk insert and one
+        # projection update; its lines are flushed before the next chunk starts
+        for start in range(0, len(files), ANALYZE_BATCH_CHUNK):
+            chunk = list(enumerate(files[start:start + ANALYZE_BATCH_CHUNK], start=start))
+            decoded = []
+            for i, f in chunk:
+                try:
+                    decoded.append((i, f.filename, decode_image(f.stream, min_side=min_side)))
+                except Exception as e:
+                    yield json.dumps({'index': i, 'filename': f.filename, 'error': f'could not decode image: {e}'}) + '\n'
+            if not decoded:
+                continue
+            pils = [pil for _, _, pil in decoded]
+            results = explain_images(stack, model_name, pils, want_heatmap, heatmap_format, batched=True,
+                                     cam_classes=cam_classes)
+            stored = store_predictions(model_name, pils, results, user)
+            for (i, name, _), result, st in zip(decoded, results, stored):
+                line = analysis_response(model_name, result, st)
+                line.update({'index': i, 'filename': name})
+                yield json.dumps(line) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+@app.get('/metrics/perf')
+def metrics_perf():
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
 
 
 @app.post('/feedback')
@@ -292,7 +606,17 @@ def feedback():
 
 @app.get('/metrics/summary')
 def metrics_summary():
-    counts, conf, classes = compute_confusion_and_counts(EMBED_WINDOW)
+    # Optional filters: model, since/until (unix seconds, bucket-aligned), top (class list size)
+    try:
+        since = float(request.args['since']) if request.args.get('since') else None
+        until = float(request.args['until']) if request.args.get('until') else None
+        top = max(1, int(request.args.get('top', '5')))
+    except ValueError:
+        return jsonify({'error': 'since/until must be unix seconds and top an integer'}), 400
+    model = request.args.get('model')
+    counts, conf, classes = compute_confusion_and_counts(
+        canonical_model_name(model) if model else None, since, until, top,
+    )
     return jsonify({
         'counts': counts,
         'confusion': conf,
@@ -300,40 +624,67 @@ def metrics_summary():
     })
 
 
+def downsample_points(pts: List[dict], max_points: int, bbox: Tuple[float, float, float, float] | None = None) -> List[dict]:
+    """Level-of-detail thinning: bin points on a grid of about `max_points`
+    cells over the viewport (or their bounds) and keep the newest point per
+    cell, with `count` set to how many points it stands for."""
+    if max_points <= 0 or len(pts) <= max_points:
+        return pts
+    g = max(1, int(np.sqrt(max_points)))
+    if bbox is None:
+        xs = [p['x'] for p in pts]
+        ys = [p['y'] for p in pts]
+        bbox = (min(xs), min(ys), max(xs), max(ys))
+    x0, y0, x1, y1 = bbox
+    sx = g / ((x1 - x0) or 1.0)
+    sy = g / ((y1 - y0) or 1.0)
+    cells: dict = {}
+    for p in pts:  # chronological, so the newest point ends up representing its cell
+        key = (min(g - 1, int((p['x'] - x0) * sx)), min(g - 1, int((p['y'] - y0) * sy)))
+        prev = cells.get(key)
+        cells[key] = dict(p, count=(prev['count'] if prev else 0) + 1)
+    return list(cells.values())
+
+
+def _parse_cursor(raw: str | None) -> Tuple[float, str] | None:
+    if not raw:
+        return None
+    ts, _, pid = raw.partition('|')
+    return float(ts), pid
+
+
 @app.get('/embeddings/points')
 def embeddings_points():
     try:
         limit = int(request.args.get('limit', str(EMBED_WINDOW)))
-    except Exception:
-        limit = EMBED_WINDOW
-    rows = last_n_predictions(limit)
-
-    # Determine most common embedding dimensionality among recent rows
-    def emb_len_safe(r):
-        try:
-            return len((r['embedding'] or '').split(','))
-        except Exception:
-            return 0
-
-    from collections import Counter
-    dims = [emb_len_safe(r) for r in rows]
-    if not dims:
-        return jsonify({'points': []})
-    dim_counts = Counter(dims)
-    target_dim, _ = max(dim_counts.items(), key=lambda x: x[1])
-    rows_dim = [r for r in rows if emb_len_safe(r) == target_dim]
-
-    # If any missing coords in this subset, recompute PCA for them
-    if any(r['emb2d_x'] is None or r['emb2d_y'] is None for r in rows_dim):
-        import numpy as np
-        vecs = [np.array(list(map(float, r['embedding'].split(',')))) for r in rows_dim]
-        Z = pca2d(vecs)
-        update_emb2d([r['id'] for r in rows_dim], Z)
-        rows = last_n_predictions(limit)
-        rows_dim = [r for r in rows if emb_len_safe(r) == target_dim]
+        max_points = int(request.args.get('max_points', '0'))
+        cursor = _parse_cursor(request.args.get('since'))
+        bbox = tuple(float(v) for v in request.args['bbox'].split(',')) if request.args.get('bbox') else None
+    except ValueError:
+        return jsonify({'error': 'invalid limit, max_points, since or bbox'}), 400
+    if bbox is not None and len(bbox) != 4:
+        return jsonify({'error': 'bbox must be x0,y0,x1,y1'}), 400
+    limit = max(1, limit)
+    req_model = request.args.get('model')
+
+    # Determine the most common (model, embedding dim) group among recent rows
+    group = most_common_group(limit, canonical_model_name(req_model) if req_model else None)
+    if group is None:
+        return jsonify({'points': [], 'cursor': request.args.get('since'), 'more': False})
+    model, target_dim = group
+    rows, nxt, more = embedding_points(model, target_dim, limit, cursor=cursor, bbox=bbox)
+
+    # Project any rows missing coords in this group (only these need their embeddings)
+    missing = [r['id'] for r in rows if r['emb2d_x'] is None or r['emb2d_y'] is None]
+    if missing:
+        found = get_predictions(missing)
+        filled = [found[pid] for pid in missing if pid in found]
+        filled = fill_missing_coords(filled, embedding_matrix([r['embedding_f32'] for r in filled], target_dim), model, target_dim)
+        coords = {r['id']: (r['emb2d_x'], r['emb2d_y']) for r in filled}
+        rows = [dict(r, emb2d_x=coords[r['id']][0], emb2d_y=coords[r['id']][1]) if r['id'] in coords else r for r in rows]
 
     pts = []
-    for r in rows_dim:
+    for r in rows:
         if r['emb2d_x'] is None or r['emb2d_y'] is None:
             continue
         pts.append({
@@ -341,9 +692,51 @@ def embeddings_points():
             'x': float(r['emb2d_x']),
             'y': float(r['emb2d_y']),
             'label': r['predicted_label'],
-            'thumb': r['thumb_b64'],
+            'thumb_url': f"/thumbs/{r['thumb_id']}" if r['thumb_id'] else None,
         })
-    return jsonify({'points': pts})
+    if cursor is None:
+        # Deltas are never thinned so clients can merge them by id
+        pts = downsample_points(pts, max_points, bbox)
+    return jsonify({
+        'points': pts,
+        'cursor': f'{nxt[0]!r}|{nxt[1]}' if nxt else None,
+        'more': more,
+        'model': model,
+    })
+
+
+@app.get('/export/<part>.npy')
+def export_npy(part):
+    # Streams one part of an export; request both parts with the same `until` to get aligned rows
+    if part not in EXPORT_PARTS:
+        return jsonify({'error': f"part must be one of {', '.join(EXPORT_PARTS)}"}), 404
+    try:
+        dim = int(request.args['dim']) if request.args.get('dim') else None
+        since = float(request.args['since']) if request.args.get('since') else None
+        until = float(request.args['until']) if request.args.get('until') else None
+    except ValueError:
+        return jsonify({'error': 'dim must be an integer and since/until unix seconds'}), 400
+    ex = Export(canonical_model_name(request.args.get('model')), dim, since, until)
+    resp = Response(stream_with_context(ex.iter_npy(part)), mimetype='application/octet-stream')
+    resp.headers['Content-Length'] = str(ex.nbytes(part))
+    resp.headers['Content-Disposition'] = f'attachment; filename="{ex.model}.{part}.npy"'
+    resp.headers['X-Export-Rows'] = str(ex.n)
+    resp.headers['X-Export-Dim'] = str(ex.dim)
+    resp.headers['X-Export-Until'] = repr(ex.until)
+    return resp
+
+
+@app.get('/thumbs/<tid>')
+def thumb(tid):
+    found = get_thumb(tid)
+    if found is None:
+        return jsonify({'error': 'unknown thumbnail'}), 404
+    mimetype, data = found
+    resp = Response(data, mimetype=mimetype)
+    # Content-addressed: the bytes behind an id never change
+    resp.set_etag(tid)
+    resp.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return resp.make_conditional(request)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,109 @@
+import queue
+import threading
+import time
+from typing import Any, Callable, List
+
+
+class _Pending:
+    __slots__ = ('item', 'done', 'result', 'error')
+
+    def __init__(self, item: Any):
+        self.item = item
+        self.done = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+
+
+class MicroBatcher:
+    """Collects concurrent requests into batches for a single worker thread.
+
+    Callers block in `submit()` while a worker thread gathers up to
+    `max_batch` queued items, waiting at most `max_wait_ms` after the first
+    one arrives, and hands them to `run_batch(items) -> results` in one call.
+    The worker exits after `idle_timeout` seconds without work and is
+    restarted on the next submit, so idle stacks hold no thread.
+
+    `close()` only drops that idle linger: callers that still hold the stack
+    (e.g. after an LRU eviction) keep being served until the queue drains.
+    """
+
+    def __init__(
+        self,
+        run_batch: Callable[[List[Any]], List[Any]],
+        max_batch: int = 4,
+        max_wait_ms: float = 5.0,
+        idle_timeout: float = 30.0,
+        name: str = 'batcher',
+    ):
+        self.run_batch = run_batch
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.idle_timeout = idle_timeout
+        self.name = name
+        self._queue: "queue.Queue[_Pending]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+
+    def submit(self, item: Any) -> Any:
+        p = _Pending(item)
+        self._queue.put(p)
+        self._ensure_worker()
+        p.done.wait()
+        if p.error is not None:
+            raise p.error
+        return p.result
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        # The worker exits once the queue is empty instead of idling
+        self._closed = True
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name=self.name, daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> List[_Pending]:
+        first = self._queue.get(timeout=0 if self._closed else self.idle_timeout)
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            try:
+                batch = self._collect()
+            except queue.Empty:
+                with self._lock:
+                    # Re-check under the lock so a racing submit restarts us
+                    if self._queue.empty():
+                        self._thread = None
+                        return
+                continue
+            try:
+                results = self.run_batch([p.item for p in batch])
+                for p, r in zip(batch, results):
+                    p.result = r
+            except BaseException as e:  # deliver failures to every waiting caller
+                for p in batch:
+                    p.error = e
+            finally:
+                for p in batch:
+                    p.done.set()
+            if self._closed and self._queue.empty():
+                with self._lock:
+                    self._thread = None
+                return
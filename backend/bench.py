@@ -0,0 +1,457 @@
+"""Benchmarks for the analyze pipeline.
+
+    python bench.py run [--models a,b] [--db-rows 1000,100000] [--concurrency 1,4,8]
+                        [--requests 64] [--url http://host:5050] [--out bench.json]
+    python bench.py micro [--out micro.json]
+    python bench.py compare OLD.json NEW.json [--threshold 0.1]
+
+`run` measures throughput and p50/p99 latency of /analyze, /embeddings/points
+and /metrics/summary for each model, DB size and concurrency level. Each
+(model, DB size) pair runs in a fresh subprocess against its own seeded
+SQLite file, driving the Flask app in-process, so peak RSS is per scenario.
+With --url the same load is sent to a running server (e.g. a local gunicorn)
+instead, and the DB is used as-is. `compare` prints the relative change of
+every metric between two result files and exits non-zero on regressions.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+ALL_MODELS = ['mobilenet_v3_small', 'mobilenet_v3_large', 'efficientnet_b0', 'efficientnet_b3', 'resnet50', 'convnext_tiny']
+ENDPOINTS = ('/analyze', '/embeddings/points', '/metrics/summary')
+
+
+# -----------------------------------------------------------------------------
+# Synthetic corpus and stats helpers
+# -----------------------------------------------------------------------------
+
+def synthetic_images(n: int, size: Tuple[int, int] = (640, 480), seed: int = 0) -> List[bytes]:
+    """`n` distinct JPEGs (smooth gradients plus random blobs), reproducible for a seed.
+
+    Every image differs, so the result cache never short-circuits a request.
+    """
+    rng = np.random.default_rng(seed)
+    w, h = size
+    yy, xx = np.mgrid[0:h, 0:w].astype(np.float32)
+    out = []
+    for _ in range(n):
+        base = rng.uniform(0, 255, 3)
+        grad = rng.uniform(-0.3, 0.3, (3, 2))
+        img = np.stack([base[c] + grad[c, 0] * xx + grad[c, 1] * yy for c in range(3)], axis=-1)
+        for _ in range(6):
+            cx, cy, r = rng.uniform(0, w), rng.uniform(0, h), rng.uniform(20, 120)
+            mask = (xx - cx) ** 2 + (yy - cy) ** 2 < r * r
+            img[mask] = rng.uniform(0, 255, 3)
+        img += rng.normal(0, 8, img.shape)
+        buf = io.BytesIO()
+        Image.fromarray(np.clip(img, 0, 255).astype(np.uint8)).save(buf, format='JPEG', quality=90)
+        out.append(buf.getvalue())
+    return out
+
+
+def summarize(latencies: List[float], wall: float, errors: int) -> Dict[str, float]:
+    xs = np.asarray(latencies) * 1000.0
+    return {
+        'n': int(xs.size),
+        'errors': errors,
+        'rps': round(xs.size / wall, 3) if wall > 0 else 0.0,
+        'p50_ms': round(float(np.percentile(xs, 50)), 3) if xs.size else None,
+        'p99_ms': round(float(np.percentile(xs, 99)), 3) if xs.size else None,
+        'mean_ms': round(float(xs.mean()), 3) if xs.size else None,
+    }
+
+
+def timeit(fn: Callable[[], Any], repeat: int = 50, warmup: int = 3) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return summarize(times, sum(times), 0)
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(rss / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+# -----------------------------------------------------------------------------
+# Load generation
+# -----------------------------------------------------------------------------
+
+class InProcessClient:
+    """Requests against the Flask app object, one test client per thread."""
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self.local = threading.local()
+
+    def _client(self):
+        c = getattr(self.local, 'client', None)
+        if c is None:
+            c = self.local.client = self.app.test_client()
+        return c
+
+    def get(self, path: str) -> Tuple[int, bytes]:
+        r = self._client().get(path)
+        return r.status_code, r.data
+
+    def post_image(self, path: str, data: bytes, fields: Dict[str, str]) -> Tuple[int, bytes]:
+        form = dict(fields, image=(io.BytesIO(data), 'bench.jpg'))
+        r = self._client().post(path, data=form, content_type='multipart/form-data')
+        return r.status_code, r.data
+
+
+class HttpClient:
+    """The same interface over HTTP, for a separately started server."""
+
+    def __init__(self, base: str):
+        self.base = base.rstrip('/')
+
+    def get(self, path: str) -> Tuple[int, bytes]:
+        try:
+            with urllib.request.urlopen(self.base + path, timeout=120) as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+    def post_image(self, path: str, data: bytes, fields: Dict[str, str]) -> Tuple[int, bytes]:
+        boundary = uuid.uuid4().hex
+        parts = []
+        for k, v in fields.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{k}"\r\n\r\n{v}\r\n'.encode())
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="bench.jpg"\r\n'
+            'Content-Type: image/jpeg\r\n\r\n'.encode() + data + b'\r\n'
+        )
+        parts.append(f'--{boundary}--\r\n'.encode())
+        req = urllib.request.Request(
+            self.base + path, data=b''.join(parts), method='POST',
+            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=120) as r:
+                return r.status, r.read()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read()
+
+
+def drive(call: Callable[[int], Tuple[int, bytes]], n: int, concurrency: int) -> Dict[str, float]:
+    """Issue `n` calls from `concurrency` threads; latency is per call, throughput over the wall time."""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(i: int):
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            status, _ = call(i)
+            ok = status < 400
+        except Exception:
+            ok = False
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+            if not ok:
+                errors += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        list(ex.map(one, range(n)))
+    return summarize(latencies, time.perf_counter() - t0, errors)
+
+
+def load_endpoints(client, model: str, images: List[bytes], n: int, concurrencies: List[int]) -> Dict[str, Any]:
+    out: Dict[str, Any] = {ep: {} for ep in ENDPOINTS}
+    offset = 0
+    for c in concurrencies:
+        # Fresh images for every level so nothing is served from the result cache
+        batch = images[offset:offset + n]
+        offset += n
+        out['/analyze'][f'c{c}'] = drive(
+            lambda i: client.post_image('/analyze', batch[i % len(batch)], {'model': model}), n, c)
+        out['/embeddings/points'][f'c{c}'] = drive(
+            lambda i: client.get(f'/embeddings/points?model={model}'), n, c)
+        out['/metrics/summary'][f'c{c}'] = drive(lambda i: client.get('/metrics/summary'), n, c)
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Scenario (runs in its own process)
+# -----------------------------------------------------------------------------
+
+def seed_db(model: str, dim: int, rows: int, chunk: int = 5000, seed: int = 0):
+    """Fill the (already initialized) DB with `rows` synthetic predictions for `model`."""
+    from storage import insert_predictions
+    rng = np.random.default_rng(seed)
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 48), (120, 140, 160)).save(buf, format='JPEG')
+    thumb = buf.getvalue()
+    labels = [f'class_{i}' for i in range(50)]
+    for start in range(0, rows, chunk):
+        m = min(chunk, rows - start)
+        embs = rng.standard_normal((m, dim)).astype(np.float32)
+        xy = rng.standard_normal((m, 2))
+        insert_predictions([
+            dict(
+                pid=f'bench_{start + i:08d}', label=labels[(start + i) % len(labels)], prob=0.5,
+                embedding=embs[i], emb2d=(float(xy[i, 0]), float(xy[i, 1])), thumb=thumb, model=model,
+            )
+            for i in range(m)
+        ])
+
+
+def run_scenario(args) -> Dict[str, Any]:
+    os.environ['DB_PATH'] = args.db
+    os.environ['RESULT_CACHE_BYTES'] = '0'
+    os.environ['MODEL_NAME'] = args.model
+    os.environ['MODEL_PRELOAD'] = ''
+    import app as app_module
+    from model import get_stack
+    from storage import get_group
+
+    t0 = time.perf_counter()
+    get_stack(args.model)
+    load_s = time.perf_counter() - t0
+    rss_after_load = peak_rss_mb()
+
+    client = InProcessClient(app_module.app)
+    images = synthetic_images(args.requests * (len(args.concurrency) + 1) + 2, seed=args.seed)
+    status, body = client.post_image('/analyze', images[-1], {'model': args.model})
+    if status >= 400:
+        raise RuntimeError(f'warm-up /analyze failed: {status} {body[:200]!r}')
+    pid = json.loads(body)['id']
+    _, dim = get_group(pid)
+
+    t0 = time.perf_counter()
+    seed_db(args.model, dim, args.db_rows, seed=args.seed)
+    seed_s = time.perf_counter() - t0
+    # Builds the neighbor index over the seeded rows; timed on its own
+    t0 = time.perf_counter()
+    client.post_image('/analyze', images[-2], {'model': args.model})
+    first_after_seed_s = time.perf_counter() - t0
+
+    endpoints = load_endpoints(client, args.model, images, args.requests, args.concurrency)
+    neighbors = timeit(lambda: app_module.build_neighbors(pid, k=5), repeat=50)
+    return {
+        'model': args.model,
+        'db_rows': args.db_rows,
+        'emb_dim': dim,
+        'model_load_s': round(load_s, 3),
+        'seed_s': round(seed_s, 3),
+        'first_analyze_after_seed_s': round(first_after_seed_s, 3),
+        'endpoints': endpoints,
+        'build_neighbors': neighbors,
+        'rss_after_load_mb': rss_after_load,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+# -----------------------------------------------------------------------------
+# Micro-benchmarks
+# -----------------------------------------------------------------------------
+
+def run_micro(repeat: int = 50) -> Dict[str, Any]:
+    from model import pca2d, make_heatmap_rgba, pil_to_base64_datauri, make_thumb
+    rng = np.random.default_rng(0)
+    out: Dict[str, Any] = {}
+    for n, d in ((200, 576), (200, 1280), (200, 2048)):
+        X = rng.standard_normal((n, d)).astype(np.float32)
+        out[f'pca2d/{n}x{d}'] = timeit(lambda: pca2d(X), repeat)
+    for side in (7, 14, 224):
+        cam = rng.random((side, side)).astype(np.float32)
+        out[f'make_heatmap_rgba/{side}'] = timeit(lambda: make_heatmap_rgba(cam), repeat)
+    photo = Image.open(io.BytesIO(synthetic_images(1)[0])).convert('RGB')
+    overlay = make_heatmap_rgba(rng.random((7, 7)).astype(np.float32)).resize((512, 384))
+    thumb = make_thumb(photo)
+    out['pil_to_base64_datauri/thumb_jpeg'] = timeit(lambda: pil_to_base64_datauri(thumb, fmt='JPEG'), repeat)
+    out['pil_to_base64_datauri/overlay_png_512'] = timeit(lambda: pil_to_base64_datauri(overlay, fmt='PNG'), repeat)
+    return out
+
+
+# -----------------------------------------------------------------------------
+# Compare
+# -----------------------------------------------------------------------------
+
+def flatten(results: Dict[str, Any]) -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for sc in results.get('scenarios', []):
+        prefix = f"{sc['model']}/{sc['db_rows']}"
+        for ep, levels in sc.get('endpoints', {}).items():
+            for level, st in levels.items():
+                for k in ('rps', 'p50_ms', 'p99_ms'):
+                    if st.get(k) is not None:
+                        flat[f'{prefix}{ep}/{level}/{k}'] = st[k]
+        for k in ('p50_ms', 'p99_ms'):
+            if sc.get('build_neighbors', {}).get(k) is not None:
+                flat[f'{prefix}/build_neighbors/{k}'] = sc['build_neighbors'][k]
+        flat[f'{prefix}/peak_rss_mb'] = sc.get('peak_rss_mb')
+    for name, st in results.get('micro', {}).items():
+        for k in ('p50_ms', 'p99_ms'):
+            if st.get(k) is not None:
+                flat[f'micro/{name}/{k}'] = st[k]
+    return {k: v for k, v in flat.items() if v is not None}
+
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float) -> int:
+    a, b = flatten(old), flatten(new)
+    regressions = 0
+    print(f"{'metric':70s} {'old':>12s} {'new':>12s} {'change':>8s}")
+    for key in sorted(set(a) & set(b)):
+        if not a[key]:
+            continue
+        change = (b[key] - a[key]) / a[key]
+        # Throughput regresses when it drops; everything else when it grows
+        worse = -change if key.endswith('/rps') else change
+        flag = ' <-- regression' if worse > threshold else ''
+        regressions += bool(flag)
+        print(f'{key:70s} {a[key]:12.3f} {b[key]:12.3f} {change:+8.1%}{flag}')
+    for key in sorted(set(a) ^ set(b)):
+        print(f"{key:70s} {'(only in ' + ('old' if key in a else 'new') + ')':>34s}")
+    return 1 if regressions else 0
+
+
+# -----------------------------------------------------------------------------
+# CLI
+# -----------------------------------------------------------------------------
+
+def _meta(args) -> Dict[str, Any]:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                         stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'torch_threads': os.environ.get('TORCH_THREADS', '1'),
+        'args': {k: v for k, v in vars(args).items() if k != 'func'},
+    }
+
+
+def _csv(kind):
+    return lambda s: [kind(x) for x in s.split(',') if x.strip()]
+
+
+def cmd_run(args):
+    results: Dict[str, Any] = {'meta': _meta(args), 'scenarios': []}
+    if args.url:
+        client = HttpClient(args.url)
+        images = synthetic_images(args.requests * len(args.concurrency), seed=args.seed)
+        for model in args.models:
+            results['scenarios'].append({
+                'model': model, 'db_rows': 'server',
+                'endpoints': load_endpoints(client, model, images, args.requests, args.concurrency),
+            })
+    else:
+        for model in args.models:
+            for rows in args.db_rows:
+                with tempfile.TemporaryDirectory() as tmp:
+                    cmd = [
+                        sys.executable, os.path.abspath(__file__), '_scenario',
+                        '--model', model, '--db-rows', str(rows), '--db', os.path.join(tmp, 'bench.db'),
+                        '--requests', str(args.requests), '--concurrency', ','.join(map(str, args.concurrency)),
+                        '--seed', str(args.seed),
+                    ]
+                    print(f'[bench] {model} with {rows} rows ...', file=sys.stderr)
+                    proc = subprocess.run(cmd, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+                    if proc.returncode != 0:
+                        results['scenarios'].append({'model': model, 'db_rows': rows, 'error': proc.stderr[-2000:]})
+                        continue
+                    results['scenarios'].append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    if not args.no_micro:
+        results['micro'] = run_micro()
+    _write(results, args.out)
+
+
+def cmd_scenario(args):
+    print(json.dumps(run_scenario(args)))
+
+
+def cmd_micro(args):
+    _write({'meta': _meta(args), 'micro': run_micro(args.repeat)}, args.out)
+
+
+def cmd_compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    sys.exit(compare(old, new, args.threshold))
+
+
+def _write(results: Dict[str, Any], path: str | None):
+    text = json.dumps(results, indent=2)
+    if path:
+        with open(path, 'w') as f:
+            f.write(text)
+        print(f'[bench] wrote {path}', file=sys.stderr)
+    else:
+        print(text)
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description='Benchmarks for the ml-explainer backend')
+    sub = p.add_subparsers(required=True)
+
+    r = sub.add_parser('run', help='endpoint load test (plus micro-benchmarks)')
+    r.add_argument('--models', type=_csv(str), default=ALL_MODELS)
+    r.add_argument('--db-rows', type=_csv(int), default=[1000, 100000])
+    r.add_argument('--concurrency', type=_csv(int), default=[1, 4, 8])
+    r.add_argument('--requests', type=int, default=32, help='requests per endpoint and concurrency level')
+    r.add_argument('--url', help='benchmark a running server instead of the in-process app')
+    r.add_argument('--seed', type=int, default=0)
+    r.add_argument('--no-micro', action='store_true')
+    r.add_argument('--out')
+    r.set_defaults(func=cmd_run)
+
+    s = sub.add_parser('_scenario')  # internal: one (model, DB size) run in a fresh process
+    s.add_argument('--model', required=True)
+    s.add_argument('--db-rows', type=int, required=True)
+    s.add_argument('--db', required=True)
+    s.add_argument('--requests', type=int, default=32)
+    s.add_argument('--concurrency', type=_csv(int), default=[1])
+    s.add_argument('--seed', type=int, default=0)
+    s.set_defaults(func=cmd_scenario)
+
+    m = sub.add_parser('micro', help='micro-benchmarks only')
+    m.add_argument('--repeat', type=int, default=50)
+    m.add_argument('--out')
+    m.set_defaults(func=cmd_micro)
+
+    c = sub.add_parser('compare', help='compare two result files')
+    c.add_argument('old')
+    c.add_argument('new')
+    c.add_argument('--threshold', type=float, default=0.10, help='relative change counted as a regression')
+    c.set_defaults(func=cmd_compare)
+
+    args = p.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import struct
+import time
+from typing import Iterator, List
+
+import numpy as np
+
+from storage import export_page, export_stats
+
+
+# Rows fetched per DB page / written chunk
+EXPORT_CHUNK = max(1, int(os.environ.get('EXPORT_CHUNK', '4096')))
+
+PARTS = ('embeddings', 'meta')
+
+
+def npy_header(dtype: np.dtype, shape: tuple) -> bytes:
+    """.npy v1.0 header for a C-order array, padded so the data starts on a
+    64-byte boundary (what np.save writes, and what np.load(mmap_mode='r') maps)."""
+    d = "{'descr': %r, 'fortran_order': False, 'shape': %r, }" % (np.lib.format.dtype_to_descr(np.dtype(dtype)), tuple(shape))
+    pad = -(10 + len(d) + 1) % 64
+    h = (d + ' ' * pad + '\n').encode('latin1')
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(h)) + h
+
+
+class Export:
+    """A streamed export of one (model, dim) group as two .npy files.
+
+    `embeddings`: float32 [N, dim]. `meta`: a structured [N] array with
+    fixed-width UTF-8 `id`/`label`/`true_label` plus float32 `prob` and
+    float64 `timestamp`. Row i of each describes the same prediction, oldest
+    first. Opening the export counts the rows and sizes both headers up
+    front. The rows are then read in keyset pages of `chunk`, each its own
+    short query, so memory stays flat and no read transaction outlives a
+    page. Exactly `n` rows are always written: if retention archives rows
+    mid-stream, the tail is padded with zero rows (empty `id`); rows that
+    appear after the count are left out.
+    """
+
+    def __init__(self, model: str | None, dim: int | None = None, since: float | None = None,
+                 until: float | None = None):
+        # A fixed upper bound lets a second request for the other part select the same rows
+        self.until = until if until is not None else time.time()
+        self.since = since
+        self.stats = export_stats(model, dim, since, self.until)
+        self.model = model
+        self.n, self.dim = self.stats['n'], self.stats['dim']
+        self.emb_dtype = np.dtype('<f4')
+        self.meta_dtype = np.dtype([
+            ('id', f"S{max(1, self.stats['id_len'])}"),
+            ('label', f"S{max(1, self.stats['label_len'])}"),
+            ('true_label', f"S{max(1, self.stats['true_len'])}"),
+            ('prob', '<f4'),
+            ('timestamp', '<f8'),
+        ])
+
+    def header(self, part: str) -> bytes:
+        if part == 'embeddings':
+            return npy_header(self.emb_dtype, (self.n, self.dim))
+        return npy_header(self.meta_dtype, (self.n,))
+
+    def nbytes(self, part: str) -> int:
+        """Exact size of the .npy file for `part`, header included."""
+        row = self.dim * self.emb_dtype.itemsize if part == 'embeddings' else self.meta_dtype.itemsize
+        return len(self.header(part)) + self.n * row
+
+    def _chunks(self, chunk: int) -> Iterator[List | int]:
+        # Row pages, then the number of padding rows still owed (if any)
+        left, after = self.n, None
+        while left > 0:
+            rows = export_page(self.model, self.dim, self.since, self.until, after, min(chunk, left))
+            if not rows:
+                break
+            yield rows
+            left -= len(rows)
+            after = (rows[-1]['timestamp'], rows[-1]['rowid'])
+        while left > 0:
+            yield min(chunk, left)
+            left -= min(chunk, left)
+
+    def _emb_bytes(self, rows: List | int) -> bytes:
+        if isinstance(rows, int):
+            return bytes(rows * self.dim * self.emb_dtype.itemsize)
+        # Stored blobs already are little-endian float32 rows
+        return b''.join(r['embedding_f32'] or b'' for r in rows)
+
+    def _meta_bytes(self, rows: List | int) -> bytes:
+        if isinstance(rows, int):
+            return np.zeros(rows, dtype=self.meta_dtype).tobytes()
+        return np.array([
+            ((r['id'] or '').encode(), (r['predicted_label'] or '').encode(), (r['true_label'] or '').encode(),
+             r['predicted_prob'] or 0.0, r['timestamp'] or 0.0)
+            for r in rows
+        ], dtype=self.meta_dtype).tobytes()
+
+    def iter_npy(self, part: str, chunk: int = EXPORT_CHUNK) -> Iterator[bytes]:
+        """Header, then the rows of one part."""
+        yield self.header(part)
+        for rows in self._chunks(chunk):
+            yield self._emb_bytes(rows) if part == 'embeddings' else self._meta_bytes(rows)
+
+    def write(self, emb_path: str, meta_path: str, chunk: int = EXPORT_CHUNK):
+        """Write both parts in one pass over the rows."""
+        with open(emb_path, 'wb') as fe, open(meta_path, 'wb') as fm:
+            fe.write(self.header('embeddings'))
+            fm.write(self.header('meta'))
+            for rows in self._chunks(chunk):
+                fe.write(self._emb_bytes(rows))
+                fm.write(self._meta_bytes(rows))
+
+
+def main(argv: List[str] | None = None):
+    # Same default and aliases as the backend; only the CLI needs them, so torch isn't imported otherwise
+    from model import MODEL_NAME, canonical_model_name
+    ap = argparse.ArgumentParser(description='Export stored embeddings and prediction metadata as .npy files.')
+    ap.add_argument('--model', default=MODEL_NAME, help='model name or alias (default MODEL_NAME)')
+    ap.add_argument('--dim', type=int, default=None, help='embedding size (default: most common in the range)')
+    ap.add_argument('--since', type=float, default=None, help='unix seconds, inclusive')
+    ap.add_argument('--until', type=float, default=None, help='unix seconds, exclusive (default: now)')
+    ap.add_argument('--out', default='export', help='writes <out>.embeddings.npy and <out>.meta.npy')
+    args = ap.parse_args(argv)
+    ex = Export(canonical_model_name(args.model), args.dim, args.since, args.until)
+    ex.write(f'{args.out}.embeddings.npy', f'{args.out}.meta.npy')
+    print(json.dumps({'model': ex.model, 'dim': ex.dim, 'rows': ex.n, 'until': ex.until, 'out': args.out}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Optional faster CPU inference backends for the top-k/embedding path.
+
+Every backend wraps a model stack's eager fp32 module into a callable
+`fast(x) -> (logits, embedding)`. Grad-CAM always keeps using the eager
+model, since quantized/scripted/exported graphs can't be differentiated
+through the target layer. torch is imported lazily by the caller (model.py).
+"""
+import os
+import copy
+import glob
+import hashlib
+import tempfile
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+BACKENDS = ('eager', 'channels_last', 'int8_dynamic', 'int8_fx', 'jit', 'compile', 'onnx')
+
+INFER_BACKEND = os.environ.get('INFER_BACKEND', 'eager').strip().lower()
+# Minimum top-1 agreement with the fp32 model on the check set before a backend is accepted
+BACKEND_MIN_AGREEMENT = float(os.environ.get('BACKEND_MIN_AGREEMENT', '0.9'))
+# Optional folder of sample images for int8 calibration and the accuracy check
+CALIBRATION_DIR = os.environ.get('CALIBRATION_DIR', '').strip()
+CALIBRATION_MAX = int(os.environ.get('CALIBRATION_MAX', '32'))
+ONNX_OPSET = int(os.environ.get('ONNX_OPSET', '17'))
+
+# FX node names of the classifier input (embedding) and the logits per architecture
+_EMB_NODES: Dict[str, Tuple[str, str]] = {
+    'mobilenet_v3_small': ('classifier.2', 'classifier.3'),
+    'mobilenet_v3_large': ('classifier.2', 'classifier.3'),
+    'resnet50': ('flatten', 'fc'),
+    'efficientnet_b0': ('classifier.0', 'classifier.1'),
+    'efficientnet_b3': ('classifier.0', 'classifier.1'),
+    'convnext_tiny': ('classifier.1', 'classifier.2'),
+}
+
+
+def backend_for(model_name: str) -> str:
+    """Configured backend for a model: INFER_BACKEND_<MODEL> overrides INFER_BACKEND."""
+    name = os.environ.get(f'INFER_BACKEND_{model_name.upper()}', INFER_BACKEND).strip().lower()
+    return name if name in BACKENDS else 'eager'
+
+
+# Lossy backends: only enabled once checked against fp32 on real images
+LOSSY = ('int8_dynamic', 'int8_fx')
+
+
+def calibration_batch(preproc, n: int = CALIBRATION_MAX):
+    """Preprocessed sample images from CALIBRATION_DIR, or None if there are none.
+
+    Noise is no substitute: it gives int8 observers the wrong activation
+    ranges and top-1 agreement on it says nothing about photos.
+    """
+    import torch
+    xs = []
+    if CALIBRATION_DIR:
+        paths = sorted(glob.glob(os.path.join(CALIBRATION_DIR, '*')))[:n]
+        for p in paths:
+            try:
+                xs.append(preproc(Image.open(p).convert('RGB')))
+            except Exception:
+                continue
+    return torch.stack(xs, dim=0) if xs else None
+
+
+def _feature_graph(model_name: str, m):
+    """GraphModule returning {'logits', 'emb'} from the eager model (shares its weights)."""
+    from torchvision.models.feature_extraction import create_feature_extractor
+    emb_node, logits_node = _EMB_NODES[model_name]
+    return create_feature_extractor(m, return_nodes={emb_node: 'emb', logits_node: 'logits'})
+
+
+def _as_tuple_module(g):
+    import torch.nn as nn
+
+    class _LogitsAndEmbedding(nn.Module):
+        def __init__(self, inner):
+            super().__init__()
+            self.inner = inner
+
+        def forward(self, x):
+            out = self.inner(x)
+            return out['logits'], out['emb'].flatten(1)
+
+    return _LogitsAndEmbedding(g).eval()
+
+
+def _weights_digest(m) -> str:
+    # Hashes the tensors in place (buffer protocol), one at a time
+    h = hashlib.blake2b(digest_size=12)
+    for name, t in m.state_dict().items():
+        h.update(name.encode())
+        h.update(t.detach().cpu().contiguous().numpy())
+    return h.hexdigest()
+
+
+def _onnx_export(mod, m, model_name: str, side: int) -> str:
+    """Path of the ONNX export of `mod`, exporting it unless an identical one exists.
+
+    The file name covers the weights, opset and torch version, so a changed
+    checkpoint or upgrade never reuses a stale graph. Exports go to a
+    private temp file and are renamed into place, so concurrent workers
+    never read a half-written file.
+    """
+    import torch
+    key = f"{_weights_digest(m)}-op{ONNX_OPSET}-torch{torch.__version__.split('+')[0]}"
+    path = os.path.join(tempfile.gettempdir(), f'mlexplainer-{model_name}-{key}.onnx')
+    if os.path.exists(path):
+        return path
+    fd, tmp = tempfile.mkstemp(prefix=f'mlexplainer-{model_name}-', suffix='.onnx.tmp', dir=os.path.dirname(path))
+    os.close(fd)
+    try:
+        torch.onnx.export(
+            mod, (torch.zeros(1, 3, side, side),), tmp,
+            input_names=['x'], output_names=['logits', 'emb'],
+            dynamic_axes={'x': {0: 'n'}, 'logits': {0: 'n'}, 'emb': {0: 'n'}},
+            opset_version=ONNX_OPSET,
+        )
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+    return path
+
+
+def build_fast(model_name: str, m, preproc, side: int, backend: str) -> Callable:
+    """Wrap eager model `m` into `fast(x) -> (logits, emb)` for `backend`."""
+    import torch
+
+    if backend == 'channels_last':
+        # In place: the eager (Grad-CAM) path benefits from the layout as well
+        m.to(memory_format=torch.channels_last)
+        mod = _as_tuple_module(_feature_graph(model_name, m))
+        return lambda x: mod(x.contiguous(memory_format=torch.channels_last))
+
+    if backend == 'int8_dynamic':
+        # The graph gets its own containers but shares the leaf modules with `m`,
+        # so only the Linear layers are copied (quantized); the trunk stays shared
+        g = _feature_graph(model_name, m)
+        for name, sub in list(g.named_modules()):
+            if isinstance(sub, torch.nn.Linear):
+                parent, _, leaf = name.rpartition('.')
+                q = torch.ao.quantization.quantize_dynamic(torch.nn.Sequential(sub), {torch.nn.Linear}, dtype=torch.qint8)
+                setattr(g.get_submodule(parent), leaf, q[0])
+        return _as_tuple_module(g)
+
+    if backend == 'int8_fx':
+        from torch.ao.quantization import get_default_qconfig_mapping
+        from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+        calib = calibration_batch(preproc)
+        if calib is None:
+            raise ValueError('int8_fx needs sample images in CALIBRATION_DIR for static calibration')
+        mod = _as_tuple_module(_feature_graph(model_name, copy.deepcopy(m)))
+        prepared = prepare_fx(mod, get_default_qconfig_mapping('x86'), example_inputs=(calib[:1],))
+        with torch.no_grad():
+            for i in range(calib.shape[0]):
+                prepared(calib[i:i + 1])
+        return convert_fx(prepared)
+
+    if backend == 'jit':
+        mod = _as_tuple_module(_feature_graph(model_name, m))
+        with torch.no_grad():
+            traced = torch.jit.trace(mod, torch.zeros(1, 3, side, side), check_trace=False)
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+
+    if backend == 'compile':
+        mod = _as_tuple_module(_feature_graph(model_name, m))
+        return torch.compile(mod, dynamic=True)
+
+    if backend == 'onnx':
+        import onnxruntime as ort  # optional dependency
+        mod = _as_tuple_module(_feature_graph(model_name, m))
+        path = _onnx_export(mod, m, model_name, side)
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = torch.get_num_threads()
+        sess = ort.InferenceSession(path, sess_options=opts, providers=['CPUExecutionProvider'])
+
+        def run(x):
+            logits, emb = sess.run(None, {'x': x.detach().cpu().numpy().astype(np.float32)})
+            return torch.from_numpy(logits), torch.from_numpy(emb)
+        return run
+
+    raise ValueError(f"Unsupported inference backend '{backend}'")
+
+
+def check_agreement(reference: Callable, fast: Callable, x, k: int = 5) -> Dict[str, Any]:
+    """Compare `fast` against the fp32 `reference` on batch `x`: top-1 agreement,
+    mean top-k overlap and max embedding cosine distance."""
+    import torch
+    with torch.no_grad():
+        ref_logits, ref_emb = reference(x)
+        out_logits, out_emb = fast(x)
+    ref_top = ref_logits.topk(k, dim=1).indices
+    out_top = out_logits.topk(k, dim=1).indices
+    top1 = float((ref_top[:, 0] == out_top[:, 0]).float().mean())
+    overlap: List[float] = [
+        len(set(a.tolist()) & set(b.tolist())) / k for a, b in zip(ref_top, out_top)
+    ]
+    cos = torch.nn.functional.cosine_similarity(ref_emb.flatten(1), out_emb.flatten(1).float(), dim=1)
+    return {
+        'top1_agreement': top1,
+        'topk_overlap': float(np.mean(overlap)),
+        'max_emb_cos_dist': float((1 - cos).max()),
+        'n': int(x.shape[0]),
+    }
@@ -0,0 +1,217 @@
+import atexit
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+from typing import Any, Dict, List
+
+import numpy as np
+
+
+# Number of inference worker processes (0 = run the model in the request thread)
+INFER_PROCESSES = int(os.environ.get('INFER_PROCESSES', '0'))
+# Per-worker shared-memory input slot; larger batches are split to fit
+INFER_SHM_BYTES = int(float(os.environ.get('INFER_SHM_MB', '16')) * 1024 * 1024)
+# Seconds to wait for a worker's reply before treating it as hung and killing it
+INFER_TIMEOUT = float(os.environ.get('INFER_TIMEOUT', '120'))
+
+log = logging.getLogger(__name__)
+
+_POOL: 'InferencePool | None' = None
+
+
+class WorkerUnavailable(RuntimeError):
+    """No worker ran the batch (none left, or the borrowed one died or hung);
+    the caller should run it in-process."""
+
+
+def active_pool() -> 'InferencePool | None':
+    return _POOL
+
+
+def _share_module(m):
+    # Move parameters/buffers into shared memory so forked workers map the
+    # same pages instead of copy-on-write duplicating them as they are touched
+    import model as _model
+    if isinstance(m, _model.nn.Module):
+        for t in list(m.parameters()) + list(m.buffers()):
+            if t.device.type == 'cpu':
+                try:
+                    t.share_memory_()
+                except RuntimeError:
+                    pass  # e.g. non-resizable mmap storage; still shared copy-on-write
+
+
+def _worker_main(conn, shm: shared_memory.SharedMemory):
+    # Runs in the forked child: stacks were loaded by the parent and are
+    # reached through the inherited model cache
+    import model as _model
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        op, name, shape, k, cam_k = msg
+        try:
+            stack = _model.get_stack(name)
+            x = _model.torch.from_numpy(np.ndarray(shape, dtype=np.float32, buffer=shm.buf))
+            if op == 'explain':
+                res = _model.explain_batch(stack, x, k=k, cam_k=cam_k)
+            else:
+                res = _model.infer_batch(stack, x, k=k)
+            conn.send(('ok', res))
+        except Exception as e:
+            conn.send(('error', f'{type(e).__name__}: {e}'))
+
+
+class _Worker:
+    __slots__ = ('proc', 'conn', 'shm')
+
+    def __init__(self, proc, conn, shm):
+        self.proc = proc
+        self.conn = conn
+        self.shm = shm
+
+
+class InferencePool:
+    """Forked inference worker processes sharing the parent's model weights.
+
+    Models are loaded in the parent, their tensors moved to shared memory,
+    and then `n` workers are forked; each has one shared-memory input slot
+    and a pipe. `run()` borrows an idle worker, copies the batch into its
+    slot and sends only (op, model, shape, k, cam_k), so request threads in one
+    process can keep every core busy without a per-process weight copy.
+
+    A worker that dies or hangs is retired, not replaced: forking again once
+    request threads are running is unsafe. Its slot is given up, and once
+    none are left `serves()` turns false and callers run in-process.
+    """
+
+    def __init__(self, names: List[str], n: int = INFER_PROCESSES, slot_bytes: int = INFER_SHM_BYTES,
+                 timeout: float = INFER_TIMEOUT):
+        self.names = set(names)
+        self.slot_bytes = slot_bytes
+        self.timeout = timeout
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._workers: List[_Worker] = []
+        self._alive = 0
+        self._lock = threading.Lock()
+        ctx = mp.get_context('fork')
+        for i in range(n):
+            shm = shared_memory.SharedMemory(create=True, size=slot_bytes)
+            parent_conn, child_conn = ctx.Pipe()
+            proc = ctx.Process(target=_worker_main, args=(child_conn, shm), name=f'infer-worker-{i}', daemon=True)
+            proc.start()
+            child_conn.close()
+            w = _Worker(proc, parent_conn, shm)
+            self._workers.append(w)
+            self._idle.put(w)
+        self._alive = len(self._workers)
+
+    @property
+    def alive(self) -> int:
+        return self._alive
+
+    def idle(self) -> int:
+        return self._idle.qsize()
+
+    def serves(self, name: str) -> bool:
+        return name in self.names and self._alive > 0
+
+    def _borrow(self) -> _Worker:
+        # Waiters re-check `_alive` so they don't block forever once the last worker is retired
+        while True:
+            if self._alive <= 0:
+                raise WorkerUnavailable('no inference workers left')
+            try:
+                return self._idle.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+    def run(self, op: str, name: str, x, k: int = 5, cam_k: int = 1) -> List[Dict[str, Any]]:
+        """explain_batch/infer_batch for `x` [N, 3, H, W] in a worker process.
+
+        Raises WorkerUnavailable when no worker could run it.
+        """
+        per_item = max(1, x[0].numel() * 4)
+        step = max(1, self.slot_bytes // per_item)
+        if x.shape[0] > step:
+            out = []
+            for i in range(0, x.shape[0], step):
+                out.extend(self.run(op, name, x[i:i + step], k, cam_k))
+            return out
+        if per_item > self.slot_bytes:
+            raise ValueError(f'input of {per_item} bytes does not fit the {self.slot_bytes}-byte worker slot')
+
+        w = self._borrow()
+        dead = False
+        try:
+            np.copyto(np.ndarray(tuple(x.shape), dtype=np.float32, buffer=w.shm.buf), x.contiguous().numpy())
+            w.conn.send((op, name, tuple(x.shape), k, cam_k))
+            if not w.conn.poll(self.timeout):
+                # A late reply would be read by the next borrower, so the worker can't be reused
+                dead = True
+                raise WorkerUnavailable(f'inference worker {w.proc.name} did not answer within {self.timeout:g}s')
+            status, payload = w.conn.recv()
+        except (EOFError, OSError):
+            dead = True
+            raise WorkerUnavailable(f'inference worker {w.proc.name} exited')
+        finally:
+            if dead:
+                # SIGKILL, since a stopped process never acts on SIGTERM; join reaps it
+                w.proc.kill()
+                w.proc.join(timeout=5)
+                with self._lock:
+                    self._alive -= 1
+                log.warning('retired inference worker %s; %d left', w.proc.name, self._alive)
+            else:
+                self._idle.put(w)
+        if status != 'ok':
+            raise RuntimeError(payload)
+        return payload
+
+    def close(self):
+        for w in self._workers:
+            try:
+                w.conn.send(None)
+            except Exception:
+                pass
+        for w in self._workers:
+            w.proc.join(timeout=2)
+            if w.proc.is_alive():
+                w.proc.kill()
+            w.shm.close()
+            w.shm.unlink()
+        self._workers = []
+        self._alive = 0
+
+
+def start_pool(names: List[str], n: int = INFER_PROCESSES) -> 'InferencePool | None':
+    """Load `names` in this process, share their weights and fork `n` workers.
+
+    Must run at startup before any other threads are started: forking a
+    process while other threads hold locks can leave the children stuck.
+    Models outside `names` keep running in the request thread.
+    """
+    global _POOL
+    if n <= 0 or _POOL is not None:
+        return _POOL
+    import model as _model
+    loaded = []
+    for name in names:
+        try:
+            stack = _model.get_stack(name)
+        except Exception:
+            continue
+        _share_module(stack['model'])
+        _share_module(stack.get('fast'))
+        loaded.append(stack['name'])
+    if not loaded:
+        return None
+    _POOL = InferencePool(loaded, n)
+    atexit.register(_POOL.close)
+    return _POOL
@@ -0,0 +1,159 @@
+import os
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+
+JOB_WORKERS = max(1, int(os.environ.get('JOB_WORKERS', '1')))
+JOB_QUEUE_MAX = max(1, int(os.environ.get('JOB_QUEUE_MAX', '16')))
+# Finished jobs stay retrievable for this many seconds
+JOB_TTL = float(os.environ.get('JOB_TTL', '300'))
+
+TERMINAL = ('done', 'error', 'cancelled')
+
+
+class QueueFull(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    """One queued unit of work and the results it has published so far.
+
+    The worker function calls `publish(event, data)` as each stage finishes;
+    pollers read `snapshot()` and SSE clients follow `events_since()`.
+    """
+
+    def __init__(self, job_id: str, fn: Callable[['Job'], None]):
+        self.id = job_id
+        self.fn = fn
+        self.status = 'queued'
+        self.result: Dict[str, Any] = {}
+        self.error: str | None = None
+        self.created = time.time()
+        self.updated = self.created
+        self.events: List[Tuple[str, Any]] = []
+        self._cancel = threading.Event()
+        self._cond = threading.Condition()
+
+    @property
+    def finished(self) -> bool:
+        return self.status in TERMINAL
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def publish(self, event: str, data: Dict[str, Any] | None = None, status: str | None = None):
+        with self._cond:
+            if data:
+                self.result.update(data)
+            if status is not None:
+                self.status = status
+            self.updated = time.time()
+            self.events.append((event, data or {}))
+            self._cond.notify_all()
+
+    def cancel(self) -> bool:
+        """Request cancellation; a running job stops at its next stage boundary."""
+        with self._cond:
+            if self.finished:
+                return False
+            self._cancel.set()
+            if self.status == 'queued':
+                self.status = 'cancelled'
+                self.updated = time.time()
+                self.events.append(('cancelled', {}))
+                self._cond.notify_all()
+            return True
+
+    def events_since(self, seq: int, timeout: float) -> List[Tuple[int, str, Any]]:
+        """Events after index `seq`, waiting up to `timeout` seconds for new ones."""
+        with self._cond:
+            if len(self.events) <= seq and not self.finished:
+                self._cond.wait(timeout)
+            return [(i, e, d) for i, (e, d) in enumerate(self.events[seq:], start=seq)]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            out = dict(self.result)
+            out.update({'id': self.id, 'status': self.status})
+            if self.error is not None:
+                out['error'] = self.error
+            return out
+
+
+class JobQueue:
+    """Bounded in-process job queue served by a fixed set of worker threads.
+
+    `submit()` raises QueueFull instead of blocking once `max_queue` jobs are
+    waiting, so a burst of slow requests is turned away rather than piling up
+    threads and memory. Workers start on first use.
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_queue: int = JOB_QUEUE_MAX, ttl: float = JOB_TTL):
+        self.workers = workers
+        self.ttl = ttl
+        self._queue: "queue.Queue[Job]" = queue.Queue(maxsize=max_queue)
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def submit(self, job_id: str, fn: Callable[[Job], None]) -> Job:
+        job = Job(job_id, fn)
+        self._expire()
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            raise QueueFull(f'{self._queue.maxsize} jobs already queued')
+        with self._lock:
+            self._jobs[job_id] = job
+        self._ensure_workers()
+        return job
+
+    def get(self, job_id: str) -> Job | None:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for jid in [jid for jid, j in self._jobs.items() if j.finished and j.updated < cutoff]:
+                del self._jobs[jid]
+
+    def _ensure_workers(self):
+        with self._lock:
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                t = threading.Thread(target=self._loop, name=f'job-worker-{len(self._threads)}', daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _loop(self):
+        while True:
+            job = self._queue.get()
+            if job.cancelled:
+                continue
+            job.publish('started', status='running')
+            try:
+                job.fn(job)
+                job.publish('done', status='done')
+            except JobCancelled:
+                job.publish('cancelled', status='cancelled')
+            except Exception as e:  # surface the failure to pollers instead of killing the worker
+                job.error = str(e)
+                job.publish('error', {'error': str(e)}, status='error')
+
+
+jobs = JobQueue()
@@ -1,15 +1,31 @@
+from __future__ import annotations
+
 import io
 import os
 import uuid
-from typing import List, Tuple, Dict, Any
+import threading
+from typing import List, Tuple, Dict, Any, TYPE_CHECKING
 from collections import OrderedDict
+from contextlib import contextmanager
 
 import numpy as np
 from PIL import Image
-import torch
-import torch.nn as nn
-import torchvision as tv
-from huggingface_hub import hf_hub_download
+
+from batching import MicroBatcher
+from inference_pool import WorkerUnavailable, active_pool
+from perf import span
+from inference_backends import backend_for, build_fast, check_agreement, calibration_batch, BACKEND_MIN_AGREEMENT, LOSSY
+
+if TYPE_CHECKING:
+    import torch
+    import torch.nn as nn
+
+# torch/torchvision/huggingface_hub are imported on first model load (see
+# _import_torch) so the app answers /health before the heavy imports finish.
+torch = None
+nn = None
+tv = None
+_TORCH_LOCK = threading.Lock()
 
 
 # -----------------------------------------------------------------------------
@@ -17,13 +33,42 @@ from huggingface_hub import hf_hub_download
 # -----------------------------------------------------------------------------
 
 MODEL_NAME = os.environ.get("MODEL_NAME", "mobilenet_v3_small").lower()
-MODEL_CACHE_MAX = int(os.environ.get("MODEL_CACHE_MAX", "1"))  # limit concurrently loaded models
-
-# Limit torch intra-op threads on small instances unless overridden
-try:
-    torch.set_num_threads(int(os.environ.get("TORCH_THREADS", "1")))
-except Exception:
-    pass
+MODEL_CACHE_MAX = int(os.environ.get("MODEL_CACHE_MAX", "0"))  # optional count limit on loaded models (0 = budget only)
+# Byte budget for cached model weights; least recently used models are evicted to stay under it
+MODEL_CACHE_BYTES = int(os.environ.get("MODEL_CACHE_BYTES", str(256 * 1024 * 1024)))
+# Models to load and warm in the background at startup (comma-separated)
+MODEL_PRELOAD = [n.strip() for n in os.environ.get("MODEL_PRELOAD", MODEL_NAME).split(",") if n.strip()]
+# Micro-batching of concurrent explain requests per model stack (1 disables)
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "4"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+# Uploads are decoded (JPEG draft mode) down to roughly this shorter side; also bounds the overlay size
+DECODE_MIN_SIDE = int(os.environ.get("DECODE_MIN_SIDE", "512"))
+# Longest side of the server-rendered heatmap PNG (0 = image size)
+HEATMAP_MAX_SIDE = int(os.environ.get("HEATMAP_MAX_SIDE", "512"))
+# Side of the compact CAM grid payload (0 = native target-layer grid, e.g. 7x7)
+HEATMAP_GRID_SIDE = int(os.environ.get("HEATMAP_GRID_SIDE", "0"))
+# Grad-CAM differentiates only the layers after the target layer (0 = full graph, for cross-checking)
+GRADCAM_TRUNCATED = os.environ.get("GRADCAM_TRUNCATED", "1") != "0"
+
+
+
+def _import_torch():
+    global torch, nn, tv
+    if tv is not None:
+        return
+    with _TORCH_LOCK:
+        if tv is not None:
+            return
+        import torch as _torch
+        import torch.nn as _nn
+        import torchvision as _tv
+        # Limit torch intra-op threads on small instances unless overridden
+        try:
+            _torch.set_num_threads(int(os.environ.get("TORCH_THREADS", "1")))
+        except Exception:
+            pass
+        torch, nn = _torch, _nn
+        tv = _tv
 
 # Optional: Hugging Face repo to pull weights from
 HF_REPO_DEFAULT = os.environ.get("HUGGINGFACE_REPO_ID", "shiloh4/mlexplainer_weights").strip()
@@ -38,6 +83,27 @@ DEFAULT_HF_FILENAMES: Dict[str, str] = {
 }
 
 
+def _load_state_file(path: str) -> Dict[str, Any]:
+    """Load a checkpoint without reading it into a second in-RAM copy.
+
+    `.safetensors` files and zip-format `.pth` files are memory-mapped, so
+    tensors are backed by the page cache and `load_state_dict(assign=True)`
+    adopts them directly. Older pickle-format checkpoints fall back to a
+    regular load.
+    """
+    if path.endswith('.safetensors'):
+        from safetensors.torch import load_file  # optional dependency
+        return load_file(path, device='cpu')
+    try:
+        state = torch.load(path, map_location="cpu", mmap=True, weights_only=True)
+    except Exception:
+        state = torch.load(path, map_location="cpu")
+    # Some checkpoints saved as dict with 'state_dict'
+    if isinstance(state, dict) and "state_dict" in state:
+        state = state["state_dict"]
+    return state
+
+
 def _load_from_hf(model_key: str) -> Dict[str, Any] | None:
     """Attempt to download a state_dict from Hugging Face for the given model key.
     Returns a dict (state_dict) or None if unavailable.
@@ -52,86 +118,75 @@ def _load_from_hf(model_key: str) -> Dict[str, Any] | None:
     if not repo_id or not filename:
         return None
     try:
+        from huggingface_hub import hf_hub_download
         local_path = hf_hub_download(repo_id=repo_id, filename=filename)
-        state = torch.load(local_path, map_location="cpu")
-        # Some checkpoints saved as dict with 'state_dict'
-        if isinstance(state, dict) and "state_dict" in state:
-            state = state["state_dict"]
-        return state
+        return _load_state_file(local_path)
     except Exception:
         return None
 
 
+def _load_from_torchvision(tvw) -> Dict[str, Any]:
+    # Same file torchvision would fetch, but memory-mapped instead of read into RAM
+    path = os.path.join(torch.hub.get_dir(), 'checkpoints', os.path.basename(tvw.url))
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        torch.hub.download_url_to_file(tvw.url, path, progress=False)
+    return _load_state_file(path)
+
+
+def _instantiate(ctor, model_key: str, tvw) -> nn.Module:
+    """Build an architecture on the meta device and adopt mmap-backed weights,
+    so random init tensors are never allocated and weights are not copied."""
+    state = _load_from_hf(model_key)
+    if state is None:
+        state = _load_from_torchvision(tvw)
+    with torch.device('meta'):
+        m = ctor(weights=None)
+    m.load_state_dict(state, assign=True)
+    return m
+
+
 def _build_model(name: str):
+    _import_torch()
     name = name.lower()
     if name in {"mobilenet_v3_small", "mnet_v3_small", "mnet_small", "mobilenet_small"}:
         tvw = tv.models.MobileNet_V3_Small_Weights.DEFAULT
-        state = _load_from_hf("mobilenet_v3_small")
-        if state is not None:
-            m = tv.models.mobilenet_v3_small(weights=None)
-            m.load_state_dict(state)
-        else:
-            m = tv.models.mobilenet_v3_small(weights=tvw)
+        m = _instantiate(tv.models.mobilenet_v3_small, "mobilenet_v3_small", tvw)
         preproc = tvw.transforms()
         classes = tvw.meta["categories"]
         target_layer = m.features[-1]
         emb_module = m.classifier[-1]
     elif name in {"mobilenet_v3_large", "mnet_v3_large", "mobilenet_large", "mnet_large"}:
         tvw = tv.models.MobileNet_V3_Large_Weights.DEFAULT
-        state = _load_from_hf("mobilenet_v3_large")
-        if state is not None:
-            m = tv.models.mobilenet_v3_large(weights=None)
-            m.load_state_dict(state)
-        else:
-            m = tv.models.mobilenet_v3_large(weights=tvw)
+        m = _instantiate(tv.models.mobilenet_v3_large, "mobilenet_v3_large", tvw)
         preproc = tvw.transforms()
         classes = tvw.meta["categories"]
         target_layer = m.features[-1]
         emb_module = m.classifier[-1]
     elif name in {"resnet50", "resnet"}:
         tvw = tv.models.ResNet50_Weights.DEFAULT
-        state = _load_from_hf("resnet50")
-        if state is not None:
-            m = tv.models.resnet50(weights=None)
-            m.load_state_dict(state)
-        else:
-            m = tv.models.resnet50(weights=tvw)
+        m = _instantiate(tv.models.resnet50, "resnet50", tvw)
         preproc = tvw.transforms()
         classes = tvw.meta["categories"]
         target_layer = m.layer4[-1]
         emb_module = m.fc
     elif name in {"efficientnet_b0", "effb0", "efficientnet0"}:
         tvw = tv.models.EfficientNet_B0_Weights.DEFAULT
-        state = _load_from_hf("efficientnet_b0")
-        if state is not None:
-            m = tv.models.efficientnet_b0(weights=None)
-            m.load_state_dict(state)
-        else:
-            m = tv.models.efficientnet_b0(weights=tvw)
+        m = _instantiate(tv.models.efficientnet_b0, "efficientnet_b0", tvw)
         preproc = tvw.transforms()
         classes = tvw.meta["categories"]
         target_layer = m.features[-1]
         emb_module = m.classifier[-1]
     elif name in {"efficientnet_b3", "effb3", "efficientnet3"}:
         tvw = tv.models.EfficientNet_B3_Weights.DEFAULT
-        state = _load_from_hf("efficientnet_b3")
-        if state is not None:
-            m = tv.models.efficientnet_b3(weights=None)
-            m.load_state_dict(state)
-        else:
-            m = tv.models.efficientnet_b3(weights=tvw)
+        m = _instantiate(tv.models.efficientnet_b3, "efficientnet_b3", tvw)
         preproc = tvw.transforms()
         classes = tvw.meta["categories"]
         target_layer = m.features[-1]
         emb_module = m.classifier[-1]
     elif name in {"convnext_tiny", "convnext"}:
         tvw = tv.models.ConvNeXt_Tiny_Weights.DEFAULT
-        state = _load_from_hf("convnext_tiny")
-        if state is not None:
-            m = tv.models.convnext_tiny(weights=None)
-            m.load_state_dict(state)
-        else:
-            m = tv.models.convnext_tiny(weights=tvw)
+        m = _instantiate(tv.models.convnext_tiny, "convnext_tiny", tvw)
         preproc = tvw.transforms()
         classes = tvw.meta["categories"]
         # Last stage output is fine for CAM-like visualization
@@ -141,102 +196,310 @@ def _build_model(name: str):
         raise ValueError(f"Unsupported MODEL_NAME '{name}'")
 
     m.eval()
+    if GRADCAM_TRUNCATED:
+        # No parameter needs a gradient: the trunk runs without recording a graph
+        # and Grad-CAM differentiates the head w.r.t. a leaf target activation
+        m.requires_grad_(False)
     return m, preproc, classes, target_layer, emb_module
 
 
-model, preproc, class_names, _target_layer, _emb_module = _build_model(MODEL_NAME)
+class ModuleCapture:
+    """Thread-safe capture of a module's forward input/output.
 
+    A single permanent forward hook writes into a per-thread slot, and only
+    while that thread is inside `capture()`. Concurrent forwards through the
+    same shared module therefore never see each other's tensors.
 
-@torch.no_grad()
-def predict_topk(pil_img: Image.Image, k: int = 5) -> List[Tuple[str, float]]:
-    x = preproc(pil_img).unsqueeze(0)
-    logits = model(x)
-    probs = torch.softmax(logits, dim=1)[0]
-    vals, idxs = probs.topk(k)
-    return [(class_names[int(i)], float(v)) for v, i in zip(vals, idxs)]
+    With `capture(leaf=True)` the module's output is replaced by a detached
+    copy that requires grad, so autograd records only the layers after it.
+    """
+
+    def __init__(self, module: nn.Module):
+        self.module = module
+        self._local = threading.local()
+        module.register_forward_hook(self._hook)
+
+    def _hook(self, module, input, output):
+        slot = getattr(self._local, 'slot', None)
+        if slot is None:
+            return None
+        slot['input'] = input[0]
+        if slot.get('leaf') and torch.is_grad_enabled():
+            output = output.detach().requires_grad_()
+            slot['output'] = output
+            return output
+        slot['output'] = output
+        return None
+
+    @contextmanager
+    def capture(self, leaf: bool = False):
+        prev = getattr(self._local, 'slot', None)
+        slot: Dict[str, Any] = {'leaf': leaf}
+        self._local.slot = slot
+        try:
+            yield slot
+        finally:
+            self._local.slot = prev
 
 
 class GradCAM:
+    """Reentrant Grad-CAM: captured tensors live only for the duration of a call.
+
+    Activations are recorded through a thread-scoped `ModuleCapture` and their
+    gradients are taken with `torch.autograd.grad`, so nothing is stored on the
+    instance or accumulated into parameter `.grad`, and one model can serve
+    many concurrent explain calls. With GRADCAM_TRUNCATED the target
+    activation is captured as a graph leaf: the trunk keeps no autograd state
+    and the backward pass covers only the head.
+    """
+
     def __init__(self, model: nn.Module, target_layer: nn.Module):
         self.model = model
         self.target_layer = target_layer
-        self.activations = None
-        self.gradients = None
-        self._register()
-
-    def _register(self):
-        def fwd_hook(_, __, output):
-            self.activations = output.detach()
-
-        def bwd_hook(_, grad_in, grad_out):
-            self.gradients = grad_out[0].detach()
-
-        self.target_layer.register_forward_hook(fwd_hook)
-        self.target_layer.register_full_backward_hook(bwd_hook)
+        self.target = ModuleCapture(target_layer)
 
     def generate(self, x: torch.Tensor, class_idx: int | None = None) -> np.ndarray:
-        # Forward
-        out = self.model(x)
-        if class_idx is None:
-            class_idx = int(out.argmax(dim=1))
-        score = out[:, class_idx].sum()
-        # Backward
-        self.model.zero_grad(set_to_none=True)
-        # No need to retain the graph for a single backward pass
-        score.backward()
-
-        A = self.activations  # [1, C, H, W]
-        dA = self.gradients   # [1, C, H, W]
-        weights = dA.mean(dim=(2, 3), keepdim=True)  # [1, C, 1, 1]
-        cam = (weights * A).sum(dim=1, keepdim=True)  # [1, 1, H, W]
+        with torch.enable_grad():
+            with self.target.capture(leaf=GRADCAM_TRUNCATED) as cap:
+                out = self.model(x)
+            if class_idx is None:
+                class_idx = int(out.argmax(dim=1))
+            A = cap['output']
+            dA, = torch.autograd.grad(out[:, class_idx].sum(), A)
+        return self.cams(A.detach(), dA, x.shape[2:])[0]
+
+    @staticmethod
+    def cams(A: torch.Tensor, dA: torch.Tensor, size=None) -> np.ndarray:
+        """Per-sample CAMs [N, H, W] in 0..1 from activations and their gradients.
+
+        Samples are independent in eval mode, so differentiating the sum of the
+        per-sample target scores yields each sample's own gradient. With
+        `size=None` the maps stay at the target layer's native grid (e.g. 7x7).
+        """
+        weights = dA.mean(dim=(2, 3), keepdim=True)  # [N, C, 1, 1]
+        cam = (weights * A).sum(dim=1, keepdim=True)  # [N, 1, H, W]
         cam = torch.relu(cam)
-        cam = nn.functional.interpolate(cam, size=x.shape[2:], mode='bilinear', align_corners=False)
-        cam = cam.squeeze().cpu().numpy()
-        cam = (cam - cam.min()) / (cam.max() - cam.min() + 1e-8)
-        # Drop references to intermediate tensors to allow GC
-        self.activations = None
-        self.gradients = None
-        return cam
-
+        if size is not None:
+            cam = nn.functional.interpolate(cam, size=size, mode='bilinear', align_corners=False)
+        cam = cam[:, 0].cpu().numpy()
+        lo = cam.min(axis=(1, 2), keepdims=True)
+        hi = cam.max(axis=(1, 2), keepdims=True)
+        return (cam - lo) / (hi - lo + 1e-8)
 
-# Hook the selected target layer for Grad-CAM
-grad_cam = GradCAM(model, _target_layer)
 
 # -----------------------------------------------------------------------------
 # Multi-model cache and helpers (for per-request model selection)
 # -----------------------------------------------------------------------------
 _MODEL_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_CACHE_LOCK = threading.RLock()
+_LOAD_LOCKS: Dict[str, threading.Lock] = {}
+# Loading state per model for the readiness endpoint: 'loading', 'ready' or 'error: ...'
+_STATUS: Dict[str, str] = {}
+_BATCHER_LOCK = threading.Lock()
+
+_ALIASES: Dict[str, str] = {
+    "mnet_v3_small": "mobilenet_v3_small", "mnet_small": "mobilenet_v3_small", "mobilenet_small": "mobilenet_v3_small",
+    "mnet_v3_large": "mobilenet_v3_large", "mobilenet_large": "mobilenet_v3_large", "mnet_large": "mobilenet_v3_large",
+    "resnet": "resnet50",
+    "effb0": "efficientnet_b0", "efficientnet0": "efficientnet_b0",
+    "effb3": "efficientnet_b3", "efficientnet3": "efficientnet_b3",
+    "convnext": "convnext_tiny",
+}
+
+# Approximate fp32 parameter+buffer bytes, used to make room before a model is built
+_EST_MODEL_BYTES: Dict[str, int] = {
+    "mobilenet_v3_small": 10 << 20,
+    "mobilenet_v3_large": 22 << 20,
+    "resnet50": 103 << 20,
+    "efficientnet_b0": 21 << 20,
+    "efficientnet_b3": 49 << 20,
+    "convnext_tiny": 115 << 20,
+}
 
 
-def get_stack(name: str) -> Dict[str, Any]:
+def canonical_model_name(name: str | None) -> str:
     key = (name or MODEL_NAME).lower()
-    if key in _MODEL_CACHE:
-        # LRU: mark as recently used
-        _MODEL_CACHE.move_to_end(key)
-        return _MODEL_CACHE[key]
+    return _ALIASES.get(key, key)
+
+
+def _module_bytes(m: nn.Module) -> int:
+    return sum(t.numel() * t.element_size() for t in list(m.parameters()) + list(m.buffers()))
 
-    # Enforce cache size limit to avoid loading multiple heavyweight models at once
-    while len(_MODEL_CACHE) >= max(1, MODEL_CACHE_MAX):
+
+def _evict_for(nbytes: int):
+    # Caller holds _CACHE_LOCK. Evict LRU stacks until `nbytes` more fits the budget/count limits.
+    def over() -> bool:
+        used = sum(v['bytes'] for v in _MODEL_CACHE.values())
+        too_many = MODEL_CACHE_MAX > 0 and len(_MODEL_CACHE) >= MODEL_CACHE_MAX
+        return too_many or (MODEL_CACHE_BYTES > 0 and used + nbytes > MODEL_CACHE_BYTES)
+
+    while _MODEL_CACHE and over():
+        old_key, old_val = _MODEL_CACHE.popitem(last=False)
+        # Let the batching thread exit once idle; requests already holding this
+        # stack are still served (the weights go once the last of them finishes)
+        if old_val.get('batcher') is not None:
+            old_val['batcher'].close()
+        # Best-effort help GC
         try:
-            old_key, old_val = _MODEL_CACHE.popitem(last=False)
-            # Best-effort help GC
-            try:
-                del old_val
-            except Exception:
-                pass
-        except KeyError:
-            break
+            del old_val
+        except Exception:
+            pass
+
+
+def _warm_up(stack: Dict[str, Any]):
+    # One dummy pass per path so first real requests don't pay allocator/kernel warm-up
+    side = _input_side(stack)
+    explain_batch(stack, torch.zeros(1, 3, side, side), k=1)
+    if stack['fast'] is not None:
+        infer_batch(stack, torch.zeros(1, 3, side, side), k=1)
+
 
+def get_stack(name: str) -> Dict[str, Any]:
+    key = canonical_model_name(name)
+    with _CACHE_LOCK:
+        if key in _MODEL_CACHE:
+            # LRU: mark as recently used
+            _MODEL_CACHE.move_to_end(key)
+            return _MODEL_CACHE[key]
+        load_lock = _LOAD_LOCKS.setdefault(key, threading.Lock())
+
+    # Only one thread builds a given model; others wait for it instead of building a duplicate
+    with load_lock:
+        with _CACHE_LOCK:
+            if key in _MODEL_CACHE:
+                _MODEL_CACHE.move_to_end(key)
+                return _MODEL_CACHE[key]
+            # Make room up front so the old and new weights are not resident together
+            _evict_for(_EST_MODEL_BYTES.get(key, 0))
+
+        _STATUS[key] = 'loading'
+        try:
+            stack = _load_stack(key)
+        except Exception as e:
+            _STATUS[key] = f'error: {e}'
+            raise
+        with _CACHE_LOCK:
+            _evict_for(stack['bytes'])
+            _MODEL_CACHE[key] = stack
+            _STATUS[key] = 'ready'
+        return stack
+
+
+def _load_stack(key: str) -> Dict[str, Any]:
     m, pp, classes, tgt, emb = _build_model(key)
-    _MODEL_CACHE[key] = {
+    backend = backend_for(key)
+    # Build the fast path before GradCAM/ModuleCapture hook the model: the
+    # quantized backends deep-copy (parts of) it, and the hooks hold thread-locals
+    built = _build_backend(key, m, pp, backend) if backend != 'eager' else None
+    stack = {
         'name': key,
         'model': m,
         'preproc': pp,
         'class_names': classes,
         'grad_cam': GradCAM(m, tgt),
         'emb_module': emb,
+        'emb_capture': ModuleCapture(emb),
+        'bytes': _module_bytes(m),
+        'backend': 'eager',
+        'fast': None,
     }
-    return _MODEL_CACHE[key]
+    if built is not None:
+        _attach_backend(stack, backend, *built)
+    _warm_up(stack)
+    return stack
+
+
+def _input_side(stack: Dict[str, Any]) -> int:
+    return _preproc_side(stack['preproc'])
+
+
+def _preproc_side(preproc) -> int:
+    crop = getattr(preproc, 'crop_size', [224])
+    return int(crop[0] if isinstance(crop, (list, tuple)) else crop)
+
+
+def _build_backend(key: str, m: nn.Module, preproc, backend: str) -> Tuple[Any, str | None]:
+    """(fast callable, None) or (None, build error) for `backend`."""
+    try:
+        return build_fast(key, m, preproc, _preproc_side(preproc), backend), None
+    except Exception as e:
+        return None, str(e)
+
+
+def _attach_backend(stack: Dict[str, Any], backend: str, fast, error: str | None = None):
+    """Keep the fast top-k/embedding path built by _build_backend only if it agrees with fp32.
+
+    The eager fp32 model stays in the stack for Grad-CAM. The check runs on
+    CALIBRATION_DIR images only; without them fp32-exact backends are taken
+    unchecked and int8 ones are refused. On a build error or insufficient
+    top-1 agreement the stack stays on 'eager'; the outcome is recorded in
+    stack['backend_report'].
+    """
+    if fast is None:
+        stack['backend_report'] = {'backend': backend, 'error': error}
+        return
+    try:
+        calib = calibration_batch(stack['preproc'])
+        if calib is None:
+            report = {'checked': False, 'top1_agreement': None}
+        else:
+            reference = lambda x: _eager_logits_and_emb(stack, x)
+            report = dict(check_agreement(reference, fast, calib), checked=True)
+    except Exception as e:
+        stack['backend_report'] = {'backend': backend, 'error': str(e)}
+        return
+    report['backend'] = backend
+    if report['checked']:
+        report['accepted'] = report['top1_agreement'] >= BACKEND_MIN_AGREEMENT
+    else:
+        report['accepted'] = backend not in LOSSY
+        if not report['accepted']:
+            report['error'] = f'{backend} is only enabled after an accuracy check on CALIBRATION_DIR images'
+    stack['backend_report'] = report
+    if report['accepted']:
+        stack['fast'] = fast
+        stack['backend'] = backend
+        if isinstance(fast, nn.Module) and backend.startswith('int8'):
+            # Quantized copies hold their own weights in addition to the fp32 model
+            stack['bytes'] += _module_bytes(fast)
+
+
+def backend_reports() -> Dict[str, Any]:
+    """Active inference backend (and accuracy check, if any) per loaded model."""
+    with _CACHE_LOCK:
+        return {k: {'backend': v['backend'], 'check': v.get('backend_report')} for k, v in _MODEL_CACHE.items()}
+
+
+def model_status() -> Dict[str, str]:
+    """Loading state of every model requested so far; evicted models report 'evicted'."""
+    with _CACHE_LOCK:
+        return {k: (v if v != 'ready' or k in _MODEL_CACHE else 'evicted') for k, v in _STATUS.items()}
+
+
+def loaded_models() -> Dict[str, int]:
+    """Currently cached model names and their parameter bytes, LRU first."""
+    with _CACHE_LOCK:
+        return {k: v['bytes'] for k, v in _MODEL_CACHE.items()}
+
+
+def preload_models(names: List[str] | None = None, background: bool = True) -> threading.Thread | None:
+    """Load (and warm) the given models, by default MODEL_PRELOAD, optionally
+    in a daemon thread so startup and the request path don't block on it."""
+    names = [canonical_model_name(n) for n in (names if names is not None else MODEL_PRELOAD) if n]
+
+    def run():
+        for n in names:
+            try:
+                get_stack(n)
+            except Exception:
+                pass
+
+    if not background:
+        run()
+        return None
+    t = threading.Thread(target=run, name='model-preload', daemon=True)
+    t.start()
+    return t
 
 
 def make_heatmap_rgba(cam: np.ndarray, alpha: float = 0.8) -> Image.Image:
@@ -250,70 +513,276 @@ def make_heatmap_rgba(cam: np.ndarray, alpha: float = 0.8) -> Image.Image:
     return Image.fromarray(rgba, mode='RGBA')
 
 
-def compute_heatmap_overlay(pil_img: Image.Image, overlay_alpha: float = 0.8) -> Image.Image:
-    x = preproc(pil_img).unsqueeze(0)
-    # Run once to populate activations
-    with torch.enable_grad():
-        x.requires_grad_(True)
-        logits = model(x)
-        class_idx = int(logits.argmax(dim=1))
-        cam = grad_cam.generate(x, class_idx)
-    # Heatmap sized as model input; we resize to original image size for overlay
-    heat_rgba = make_heatmap_rgba(cam, alpha=overlay_alpha).resize(pil_img.size, resample=Image.BILINEAR)
-    return heat_rgba
+def _class_grads(scores: torch.Tensor, A: torch.Tensor) -> torch.Tensor:
+    """Gradients of every score column w.r.t. A in one batched backward.
 
-
-def compute_heatmap_overlay_stack(stack: Dict[str, Any], pil_img: Image.Image, overlay_alpha: float = 0.8) -> Image.Image:
-    pp = stack['preproc']
+    `scores` is [N, K]; returns [K, *A.shape], where slice j holds
+    d scores[:, j].sum() / dA (samples are independent in eval mode).
+    """
+    n, kk = scores.shape
+    eye = torch.eye(kk, dtype=scores.dtype).unsqueeze(1).expand(kk, n, kk)
+    try:
+        dAs, = torch.autograd.grad(scores, A, grad_outputs=eye, is_grads_batched=True, retain_graph=True)
+        return dAs
+    except RuntimeError:
+        # Some head ops lack a vmap batching rule; the head is small, so loop over classes
+        return torch.stack([
+            torch.autograd.grad(scores[:, j].sum(), A, retain_graph=True)[0] for j in range(kk)
+        ])
+
+
+def explain_batch(stack: Dict[str, Any], x: torch.Tensor, k: int = 5, cam_k: int = 1) -> List[Dict[str, Any]]:
+    """Top-k, Grad-CAM and embedding for a preprocessed batch [N, 3, H, W].
+
+    Runs a single forward and one backward over the summed per-sample argmax
+    scores. The embedding is captured from the input of the classifier layer
+    and the Grad-CAM activation from the target layer, all in the same pass;
+    the backward only spans the layers after the target (GRADCAM_TRUNCATED).
+    Returns one dict per sample with 'topk' [(label, p)], 'cam' (target layer
+    grid in 0..1) and 'embedding' ([D] numpy array).
+
+    With `cam_k` > 1 the CAMs of the top `cam_k` classes are computed from the
+    same forward, with one batched backward over the class scores, and
+    returned as 'cams' [cam_k, H, W] in top-k order ('cam' is cams[0]).
+    """
     m: nn.Module = stack['model']
     gc: GradCAM = stack['grad_cam']
-    x = pp(pil_img).unsqueeze(0)
+    emb_capture: ModuleCapture = stack['emb_capture']
+    class_names_: List[str] = stack['class_names']
+
+    name = stack['name']
     with torch.enable_grad():
-        x.requires_grad_(True)
-        logits = m(x)
-        class_idx = int(logits.argmax(dim=1))
-        cam = gc.generate(x, class_idx)
-    heat_rgba = make_heatmap_rgba(cam, alpha=overlay_alpha).resize(pil_img.size, resample=Image.BILINEAR)
-    return heat_rgba
+        with span('forward', model=name), gc.target.capture(leaf=GRADCAM_TRUNCATED) as act, emb_capture.capture() as emb:
+            logits = m(x)
+        probs = torch.softmax(logits.detach(), dim=1)
+        vals, idxs = probs.topk(k, dim=1)
+        rows = torch.arange(x.shape[0])
+        A = act['output']
+        # Gradient only w.r.t. the target activation: no parameter .grad writes
+        cam_k = max(1, min(cam_k, k))
+        with span('backward', model=name):
+            if cam_k == 1:
+                dAs = torch.autograd.grad(logits[rows, idxs[:, 0]].sum(), A)[0].unsqueeze(0)
+            else:
+                dAs = _class_grads(logits.gather(1, idxs[:, :cam_k]), A)
+    # Native-grid CAMs; consumers upsample (server overlay) or ship them as-is (grid payload)
+    with span('cam', model=name):
+        A = A.detach()
+        cams = np.stack([gc.cams(A, dA) for dA in dAs], axis=1)  # [N, cam_k, H, W]
+    embs = emb['input'].detach().cpu().numpy()
+    out = []
+    for n in range(x.shape[0]):
+        res = {
+            'topk': [(class_names_[int(i)], float(v)) for v, i in zip(vals[n], idxs[n])],
+            'cam': cams[n, 0],
+            'embedding': embs[n],
+        }
+        if cam_k > 1:
+            res['cams'] = cams[n]
+        out.append(res)
+    return out
+
+
+def _run_explain_batch(stack: Dict[str, Any], items: List[Tuple[torch.Tensor, int, int]]) -> List[Dict[str, Any]]:
+    # All queued items share one forward; use the largest k/cam_k and trim per caller
+    k_max = max(k for _, k, _ in items)
+    cam_k_max = max(c for _, _, c in items)
+    results = explain_batch(stack, torch.stack([x for x, _, _ in items], dim=0), k=k_max, cam_k=cam_k_max)
+    for res, (_, k, cam_k) in zip(results, items):
+        res['topk'] = res['topk'][:k]
+        if cam_k > 1:
+            res['cams'] = res['cams'][:cam_k]
+        else:
+            res.pop('cams', None)
+    return results
+
+
+def batcher_depths() -> Dict[str, int]:
+    """Requests waiting in each loaded model's micro-batcher."""
+    with _CACHE_LOCK:
+        return {k: v['batcher'].qsize() for k, v in _MODEL_CACHE.items() if v.get('batcher') is not None}
+
+
+def get_batcher(stack: Dict[str, Any]) -> MicroBatcher:
+    # Created lazily so stacks that never see concurrent traffic pay nothing
+    with _BATCHER_LOCK:
+        b = stack.get('batcher')
+        if b is None:
+            b = MicroBatcher(
+                lambda items: _run_explain_batch(stack, items),
+                max_batch=BATCH_MAX_SIZE,
+                max_wait_ms=BATCH_MAX_WAIT_MS,
+                name=f"batcher-{stack['name']}",
+            )
+            stack['batcher'] = b
+        return b
+
+
+def decode_image(fp, min_side: int = DECODE_MIN_SIDE) -> Image.Image:
+    """Decode an upload once, as small as the pipeline allows.
+
+    JPEGs are decoded in draft mode, letting libjpeg downscale by 1/2..1/8
+    while keeping the shorter side >= `min_side`. Other formats are box-reduced
+    by an integer factor after decoding. The result feeds preprocessing, the
+    overlay size and the thumbnail alike.
+    """
+    with span('decode'):
+        img = Image.open(fp)
+        if img.format == 'JPEG':
+            img.draft('RGB', (min_side, min_side))
+        img = img.convert('RGB')
+        factor = min(img.size) // max(1, min_side)
+        if factor >= 2:
+            img = img.reduce(factor)
+    return img
 
 
-def get_embedding(pil_img: Image.Image) -> np.ndarray:
-    # Capture input to final classifier layer as embedding (works across supported models)
-    feats: Dict[str, Any] = {}
+def input_resize_side(stack: Dict[str, Any]) -> int:
+    size = getattr(stack['preproc'], 'resize_size', [256])
+    return int(size[0] if isinstance(size, (list, tuple)) else size)
 
-    def hook(module, input, output):
-        feats['emb'] = input[0].detach().cpu().numpy()  # [N, D]
 
-    h = _emb_module.register_forward_hook(hook)
-    with torch.no_grad():
-        x = preproc(pil_img).unsqueeze(0)
-        _ = model(x)
-    h.remove()
-    emb = feats['emb'].squeeze(0)
-    return emb  # shape [D]
+_INPUT_BUFFERS = threading.local()
 
 
-def get_embedding_stack(stack: Dict[str, Any], pil_img: Image.Image) -> np.ndarray:
-    feats: Dict[str, Any] = {}
+def prepare_input(stack: Dict[str, Any], pil_img: Image.Image) -> torch.Tensor:
+    """Model input [3, H, W] equivalent to the torchvision preset transform.
 
-    def hook(module, input, output):
-        feats['emb'] = input[0].detach().cpu().numpy()
+    Resize-shorter-side and center-crop are folded into one PIL resize over the
+    source crop box, and normalization is done in place into a per-thread
+    float32 buffer that is reused across requests. The returned tensor shares
+    that buffer, so it is only valid until this thread prepares its next input.
+    """
+    with span('preprocess', model=stack['name']):
+        return _prepare_input(stack, pil_img)
 
-    emb_module: nn.Module = stack['emb_module']
-    m: nn.Module = stack['model']
+
+def _pil_resample(pp) -> int:
+    # The preset's InterpolationMode (BICUBIC for EfficientNet, BILINEAR for the rest) as a PIL filter
+    mode = getattr(pp, 'interpolation', None)
+    try:
+        from torchvision.transforms.functional import pil_modes_mapping
+        return pil_modes_mapping[mode]
+    except (ImportError, KeyError):
+        return Image.BILINEAR
+
+
+def _prepare_input(stack: Dict[str, Any], pil_img: Image.Image) -> torch.Tensor:
     pp = stack['preproc']
-    h = emb_module.register_forward_hook(hook)
-    with torch.no_grad():
-        x = pp(pil_img).unsqueeze(0)
-        _ = m(x)
-    h.remove()
-    emb = feats['emb'].squeeze(0)
-    return emb
-
-
-def pca2d(vectors: List[np.ndarray]) -> np.ndarray:
-    # Simple PCA to 2D
-    X = np.stack(vectors, axis=0)  # [N, D]
+    side = _input_side(stack)
+    resize = input_resize_side(stack)
+    w, h = pil_img.size
+    scale = resize / min(w, h)
+    # Crop box in source pixels that maps onto the center `side` x `side` crop
+    cw, ch = side / scale, side / scale
+    left, top = (w - cw) / 2.0, (h - ch) / 2.0
+    img = pil_img.resize((side, side), resample=_pil_resample(pp), box=(left, top, left + cw, top + ch))
+
+    buf = getattr(_INPUT_BUFFERS, 'buf', None)
+    if buf is None or buf.shape != (3, side, side):
+        buf = _INPUT_BUFFERS.buf = np.empty((3, side, side), dtype=np.float32)
+    mean = np.asarray(getattr(pp, 'mean', [0.485, 0.456, 0.406]), dtype=np.float32)[:, None, None]
+    std = np.asarray(getattr(pp, 'std', [0.229, 0.224, 0.225]), dtype=np.float32)[:, None, None]
+    np.copyto(buf, np.asarray(img, dtype=np.uint8).transpose(2, 0, 1))
+    buf *= 1.0 / 255.0
+    buf -= mean
+    buf /= std
+    return torch.from_numpy(buf)
+
+
+def prepare_batch(stack: Dict[str, Any], pil_imgs: List[Image.Image]) -> torch.Tensor:
+    """Preprocess several images into one [N, 3, H, W] tensor (owning its memory)."""
+    side = _input_side(stack)
+    x = torch.empty(len(pil_imgs), 3, side, side)
+    for i, img in enumerate(pil_imgs):
+        x[i].copy_(prepare_input(stack, img))
+    return x
+
+
+def _in_pool(stack: Dict[str, Any], op: str, x: torch.Tensor, k: int, cam_k: int = 1) -> List[Dict[str, Any]] | None:
+    # None when the pool doesn't serve this model or no worker could take the batch
+    pool = active_pool()
+    if pool is None or not pool.serves(stack['name']):
+        return None
+    try:
+        return pool.run(op, stack['name'], x, k, cam_k)
+    except WorkerUnavailable:
+        return None
+
+
+def run_explain_batch(stack: Dict[str, Any], x: torch.Tensor, k: int = 5, cam_k: int = 1) -> List[Dict[str, Any]]:
+    """explain_batch, in an inference worker process when the pool serves this model."""
+    out = _in_pool(stack, 'explain', x, k, cam_k)
+    return out if out is not None else explain_batch(stack, x, k=k, cam_k=cam_k)
+
+
+def run_infer_batch(stack: Dict[str, Any], x: torch.Tensor, k: int = 5) -> List[Dict[str, Any]]:
+    """infer_batch, in an inference worker process when the pool serves this model."""
+    out = _in_pool(stack, 'infer', x, k)
+    return out if out is not None else infer_batch(stack, x, k=k)
+
+
+def explain_stack(stack: Dict[str, Any], pil_img: Image.Image, k: int = 5, cam_k: int = 1) -> Dict[str, Any]:
+    """Top-k, Grad-CAM and embedding for one image from a single forward pass.
+
+    With an inference pool the image goes straight to an idle worker process.
+    Otherwise, when micro-batching is enabled, the preprocessed tensor is
+    queued on the stack's batcher so concurrent requests share one batched
+    forward/backward.
+    """
+    x = prepare_input(stack, pil_img)
+    out = _in_pool(stack, 'explain', x.unsqueeze(0), k, cam_k)
+    if out is not None:
+        return out[0]
+    if BATCH_MAX_SIZE > 1:
+        return get_batcher(stack).submit((x, k, cam_k))
+    return explain_batch(stack, x.unsqueeze(0), k=k, cam_k=cam_k)[0]
+
+
+def heatmap_overlay_from_cam(cam: np.ndarray, size: Tuple[int, int], overlay_alpha: float = 0.8,
+                             max_side: int = HEATMAP_MAX_SIDE) -> Image.Image:
+    # Colorize the CAM grid, then upsample to the image size (capped at max_side, aspect kept).
+    # The colormap is linear in cam, so colorizing before the bilinear resize is equivalent.
+    w, h = size
+    if max_side > 0 and max(w, h) > max_side:
+        scale = max_side / max(w, h)
+        w, h = max(1, round(w * scale)), max(1, round(h * scale))
+    return make_heatmap_rgba(cam, alpha=overlay_alpha).resize((w, h), resample=Image.BILINEAR)
+
+
+def cam_to_grid(cam: np.ndarray, side: int = HEATMAP_GRID_SIDE, image_size: Tuple[int, int] | None = None) -> Dict[str, Any]:
+    """Compact heatmap payload: the CAM as a row-major uint8 grid in base64.
+
+    The grid stays at the target layer's resolution unless `side` > 0, in which
+    case it is bilinearly resampled to side x side. Clients colorize and scale
+    it themselves; `image_w`/`image_h` give the aspect ratio to stretch it to.
+    A stacked [K, H, W] input (one CAM per top-k class) is encoded as K
+    consecutive grids with `k` set accordingly.
+    """
+    import base64
+    stack_ = np.asarray(cam)
+    if stack_.ndim == 2:
+        stack_ = stack_[None]
+    grids = np.clip(np.rint(stack_ * 255.0), 0, 255).astype(np.uint8)
+    if side > 0 and grids.shape[1:] != (side, side):
+        grids = np.stack([
+            np.asarray(Image.fromarray(g, mode='L').resize((side, side), resample=Image.BILINEAR)) for g in grids
+        ])
+    out = {
+        'w': int(grids.shape[2]),
+        'h': int(grids.shape[1]),
+        'k': int(grids.shape[0]),
+        'encoding': 'u8',
+        'data': base64.b64encode(np.ascontiguousarray(grids).tobytes()).decode('ascii'),
+    }
+    if image_size is not None:
+        out['image_w'], out['image_h'] = int(image_size[0]), int(image_size[1])
+    return out
+
+
+def pca2d(vectors: List[np.ndarray] | np.ndarray) -> np.ndarray:
+    # Simple PCA to 2D; accepts a list of [D] vectors or an [N, D] matrix
+    X = np.asarray(vectors, dtype=np.float64)  # [N, D]
     X = X - X.mean(axis=0, keepdims=True)
     # Covariance via SVD: X = U S Vt; top-2 PCs are first two rows of Vt
     U, S, Vt = np.linalg.svd(X, full_matrices=False)
@@ -329,28 +798,51 @@ def pca2d(vectors: List[np.ndarray]) -> np.ndarray:
     return Z
 
 
-@torch.no_grad()
-def predict_topk_stack(stack: Dict[str, Any], pil_img: Image.Image, k: int = 5) -> List[Tuple[str, float]]:
-    pp = stack['preproc']
-    m: nn.Module = stack['model']
+def _eager_logits_and_emb(stack: Dict[str, Any], x: torch.Tensor) -> Tuple[torch.Tensor, torch.Tensor]:
+    with torch.no_grad(), stack['emb_capture'].capture() as emb:
+        logits = stack['model'](x)
+    return logits, emb['input']
+
+
+def infer_batch(stack: Dict[str, Any], x: torch.Tensor, k: int = 5) -> List[Dict[str, Any]]:
+    """Top-k and embedding (no Grad-CAM) for a preprocessed batch, using the
+    stack's fast backend when one was accepted and the eager model otherwise."""
     class_names_: List[str] = stack['class_names']
-    x = pp(pil_img).unsqueeze(0)
-    logits = m(x)
-    probs = torch.softmax(logits, dim=1)[0]
-    vals, idxs = probs.topk(k)
-    return [(class_names_[int(i)], float(v)) for v, i in zip(vals, idxs)]
+    with span('infer_forward', model=stack['name'], backend=stack['backend']):
+        if stack.get('fast') is not None:
+            with torch.no_grad():
+                logits, emb = stack['fast'](x)
+        else:
+            logits, emb = _eager_logits_and_emb(stack, x)
+    probs = torch.softmax(logits.float(), dim=1)
+    vals, idxs = probs.topk(k, dim=1)
+    embs = emb.float().flatten(1).cpu().numpy()
+    return [
+        {
+            'topk': [(class_names_[int(i)], float(v)) for v, i in zip(vals[n], idxs[n])],
+            'embedding': embs[n],
+        }
+        for n in range(x.shape[0])
+    ]
 
 
-def pil_to_base64_datauri(pil_img: Image.Image, fmt: str = 'PNG', quality: int = 85) -> str:
-    import base64
+def infer_stack(stack: Dict[str, Any], pil_img: Image.Image, k: int = 5) -> Dict[str, Any]:
+    return run_infer_batch(stack, prepare_input(stack, pil_img).unsqueeze(0), k=k)[0]
+
+
+def encode_image(pil_img: Image.Image, fmt: str = 'PNG', quality: int = 85) -> bytes:
     buf = io.BytesIO()
     if fmt.upper() == 'JPEG':
         pil_img.convert('RGB').save(buf, format='JPEG', quality=quality)
-        prefix = 'data:image/jpeg;base64,'
     else:
         pil_img.save(buf, format=fmt)
-        prefix = 'data:image/png;base64,'
-    return prefix + base64.b64encode(buf.getvalue()).decode('ascii')
+    return buf.getvalue()
+
+
+def pil_to_base64_datauri(pil_img: Image.Image, fmt: str = 'PNG', quality: int = 85) -> str:
+    import base64
+    prefix = 'data:image/jpeg;base64,' if fmt.upper() == 'JPEG' else 'data:image/png;base64,'
+    return prefix + base64.b64encode(encode_image(pil_img, fmt, quality)).decode('ascii')
 
 
 def make_thumb(pil_img: Image.Image, size=(64, 64)) -> Image.Image:
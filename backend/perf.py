@@ -0,0 +1,171 @@
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+
+PERF_ENABLED = os.environ.get('PERF_ENABLED', '1') != '0'
+# Recent samples kept per series for the p50/p95/p99 estimates
+PERF_WINDOW = int(os.environ.get('PERF_WINDOW', '1024'))
+# torch.profiler traces: output folder (empty disables) and fraction of /analyze requests sampled
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '').strip()
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Cumulative Prometheus-style buckets plus a window of recent samples for quantiles."""
+
+    __slots__ = ('counts', 'sum', 'count', 'recent')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.recent: deque = deque(maxlen=PERF_WINDOW)
+
+    def observe(self, v: float):
+        self.counts[bisect_left(BUCKETS, v)] += 1
+        self.sum += v
+        self.count += 1
+        self.recent.append(v)
+
+    def quantiles(self) -> Dict[float, float]:
+        xs = sorted(self.recent)
+        if not xs:
+            return {}
+        return {q: xs[min(len(xs) - 1, int(q * len(xs)))] for q in QUANTILES}
+
+
+_LOCK = threading.Lock()
+_HISTS: Dict[Labels, Histogram] = {}
+_GAUGES: Dict[str, Tuple[str, Callable[[], Dict[Labels, float]]]] = {}
+_LOCAL = threading.local()
+
+
+def _labels(**labels) -> Labels:
+    return tuple(sorted((k, str(v)) for k, v in labels.items() if v is not None))
+
+
+def observe(stage: str, seconds: float, **labels):
+    if not PERF_ENABLED:
+        return
+    key = _labels(stage=stage, **labels)
+    with _LOCK:
+        h = _HISTS.get(key)
+        if h is None:
+            h = _HISTS[key] = Histogram()
+        h.observe(seconds)
+
+
+@contextmanager
+def span(stage: str, **labels) -> Iterator[None]:
+    """Time a pipeline stage into the `stage` latency histogram.
+
+    Inside a profiled request the stage also appears as a named range in the
+    torch.profiler trace.
+    """
+    if not PERF_ENABLED:
+        yield
+        return
+    prof = getattr(_LOCAL, 'record_function', None)
+    rf = prof(stage) if prof is not None else None
+    t0 = time.perf_counter()
+    if rf is not None:
+        rf.__enter__()
+    try:
+        yield
+    finally:
+        if rf is not None:
+            rf.__exit__(None, None, None)
+        observe(stage, time.perf_counter() - t0, **labels)
+
+
+def register_gauge(name: str, fn: Callable[[], Dict[Labels, float] | float], help: str = ''):
+    """Sample `fn()` at scrape time; it returns a value or {labels: value}."""
+    _GAUGES[name] = (help, fn)
+
+
+def gauge_labels(**labels) -> Labels:
+    return _labels(**labels)
+
+
+def _fmt_labels(labels: Labels, extra: Labels = ()) -> str:
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in items) + '}'
+
+
+def render_prometheus() -> str:
+    """All series in the Prometheus text exposition format."""
+    with _LOCK:
+        hists = [(k, list(h.counts), h.sum, h.count, h.quantiles()) for k, h in _HISTS.items()]
+    lines: List[str] = [
+        '# HELP mlx_stage_seconds Latency of each pipeline stage.',
+        '# TYPE mlx_stage_seconds histogram',
+    ]
+    for labels, counts, total, n, _ in sorted(hists):
+        cum = 0
+        for le, c in zip(BUCKETS, counts):
+            cum += c
+            lines.append(f'mlx_stage_seconds_bucket{_fmt_labels(labels, (("le", repr(le)),))} {cum}')
+        lines.append(f'mlx_stage_seconds_bucket{_fmt_labels(labels, (("le", "+Inf"),))} {n}')
+        lines.append(f'mlx_stage_seconds_sum{_fmt_labels(labels)} {total:.6f}')
+        lines.append(f'mlx_stage_seconds_count{_fmt_labels(labels)} {n}')
+    lines += [
+        f'# HELP mlx_stage_seconds_quantile Stage latency quantiles over the last {PERF_WINDOW} samples.',
+        '# TYPE mlx_stage_seconds_quantile gauge',
+    ]
+    for labels, _, _, _, qs in sorted(hists):
+        for q, v in qs.items():
+            lines.append(f'mlx_stage_seconds_quantile{_fmt_labels(labels, (("quantile", str(q)),))} {v:.6f}')
+    for name, (help_, fn) in sorted(_GAUGES.items()):
+        try:
+            values = fn()
+        except Exception:
+            continue
+        if help_:
+            lines.append(f'# HELP {name} {help_}')
+        lines.append(f'# TYPE {name} gauge')
+        if not isinstance(values, dict):
+            values = {(): values}
+        for labels, v in sorted(values.items()):
+            lines.append(f'{name}{_fmt_labels(labels)} {float(v):g}')
+    return '\n'.join(lines) + '\n'
+
+
+_PROFILE_LOCK = threading.Lock()
+
+
+@contextmanager
+def maybe_profile(tag: str, requested: bool = False) -> Iterator[str | None]:
+    """Record a torch.profiler trace of the enclosed work when `requested`
+    or sampled at PROFILE_SAMPLE_RATE, writing PROFILE_DIR/<tag>.json.
+
+    Yields the trace path, or None when not profiling. One trace at a time;
+    overlapping requests run unprofiled.
+    """
+    wanted = requested or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+    if not PROFILE_DIR or not wanted or not _PROFILE_LOCK.acquire(blocking=False):
+        yield None
+        return
+    try:
+        from torch.profiler import ProfilerActivity, profile, record_function
+        path = os.path.join(PROFILE_DIR, f'{tag}.json')
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        _LOCAL.record_function = record_function
+        with profile(activities=[ProfilerActivity.CPU], record_shapes=True, with_stack=False) as prof:
+            yield path
+        prof.export_chrome_trace(path)
+    finally:
+        _LOCAL.record_function = None
+        _PROFILE_LOCK.release()
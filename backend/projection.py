@@ -0,0 +1,123 @@
+import os
+import threading
+from typing import Dict, Tuple
+
+import numpy as np
+
+
+# Refit once this many new points were projected with a stale basis, or once
+# new points reach PCA_REFIT_FRACTION of the fitted set (whichever is smaller)
+PCA_REFIT_EVERY = int(os.environ.get("PCA_REFIT_EVERY", "50"))
+PCA_REFIT_FRACTION = float(os.environ.get("PCA_REFIT_FRACTION", "0.25"))
+# Refit early when a new point lands this far outside the normalized [-1, 1] range
+PCA_REFIT_RANGE = float(os.environ.get("PCA_REFIT_RANGE", "2.0"))
+
+
+class StreamingPCA2D:
+    """2D PCA basis that projects new points in O(dim) between re-fits.
+
+    `fit()` runs a full SVD over a window of embeddings; `transform()` reuses
+    the stored mean/components/scale. Each re-fit is rotated (orthogonal
+    Procrustes) onto the previous basis over the same points, so orientation
+    and sign stay stable and existing points don't jump around on the client.
+    Each axis's scale is set by the first fit whose window has spread along
+    it (or matched to the stored anchor coords after a restart) and then kept,
+    so a re-fit never rescales the plot. Until then (e.g. a single row on a
+    fresh DB) the axis stays in raw units and every fit measures it again.
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.lock = threading.RLock()
+        self.mean: np.ndarray | None = None        # [D]
+        self.components: np.ndarray | None = None  # [2, D], orthonormal rows
+        self.scale = np.ones(2)
+        # Per axis: whether `scale` has been measured over a window with spread
+        self.scaled = np.zeros(2, dtype=bool)
+        # Largest |normalized coord| in the last fitted window
+        self.extent = 1.0
+        self.n_fit = 0
+        self.n_since_fit = 0
+
+    @property
+    def fitted(self) -> bool:
+        return self.components is not None
+
+    def fit(self, X: np.ndarray, anchor: np.ndarray | None = None) -> np.ndarray:
+        """Re-fit on [N, D] embeddings and return their [N, 2] coords.
+
+        `anchor` optionally holds previously stored coords for the same rows
+        (NaN where missing); it orients the very first fit after a restart.
+        """
+        X = np.asarray(X, dtype=np.float64)
+        mean = X.mean(axis=0)
+        Xc = X - mean
+        _, _, Vt = np.linalg.svd(Xc, full_matrices=False)
+        comps = np.zeros((2, X.shape[1]))
+        ncomp = min(2, Vt.shape[0])
+        comps[:ncomp] = Vt[:ncomp]
+        P = Xc @ comps.T  # [N, 2]
+        target, mask = None, None
+        if self.fitted:
+            target = (X - self.mean) @ self.components.T
+            mask = np.ones(X.shape[0], dtype=bool)
+        elif anchor is not None:
+            target = np.asarray(anchor, dtype=np.float64)
+            mask = np.all(np.isfinite(target), axis=1)
+        aligned = target is not None and mask.sum() >= 2
+        if aligned:
+            # Rotate/reflect the new basis onto the old one over the same points
+            U, _, Vt2 = np.linalg.svd(P[mask].T @ target[mask])
+            R = U @ Vt2
+            comps = R.T @ comps
+            P = P @ R
+        if not self.scaled.all():
+            # Normalize roughly to [-1,1]; anchors are already normalized, so
+            # match their units instead (least squares per axis). An axis
+            # with no spread yet (fewer than 2 distinct rows) keeps unit scale
+            spread = np.max(np.abs(P), axis=0) if P.size else np.zeros(2)
+            found = spread > 1e-6 * max(1.0, float(np.max(np.abs(X))) if X.size else 1.0)
+            scale = np.where(found, spread, 1.0)
+            if aligned and anchor is not None and not self.fitted:
+                num = np.sum(P[mask] ** 2, axis=0)
+                den = np.sum(P[mask] * target[mask], axis=0)
+                ok = found & (den > 1e-12)
+                scale[ok] = num[ok] / den[ok]
+            todo = ~self.scaled
+            self.scale = np.where(todo, scale, self.scale)
+            self.scaled |= todo & found
+        self.mean = mean
+        self.components = comps
+        self.extent = max(1.0, float(np.max(np.abs(P / self.scale)))) if P.size else 1.0
+        self.n_fit = X.shape[0]
+        self.n_since_fit = 0
+        return P / self.scale
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        X = np.asarray(X, dtype=np.float64).reshape(-1, self.dim)
+        Z = ((X - self.mean) @ self.components.T) / self.scale
+        self.n_since_fit += X.shape[0]
+        return Z
+
+    def needs_refit(self, z: np.ndarray | None = None) -> bool:
+        if not self.fitted:
+            return True
+        threshold = max(1, min(PCA_REFIT_EVERY, int(PCA_REFIT_FRACTION * self.n_fit)))
+        if self.n_since_fit >= threshold:
+            return True
+        # Relative to the fitted extent: with a fixed scale, a spread-out window
+        # must not trigger a re-fit on every insert
+        return z is not None and bool(np.any(np.abs(z) > PCA_REFIT_RANGE * self.extent))
+
+
+_PROJECTORS: Dict[Tuple[str | None, int], StreamingPCA2D] = {}
+_PROJECTORS_LOCK = threading.Lock()
+
+
+def get_projector(model: str | None, dim: int) -> StreamingPCA2D:
+    key = (model, int(dim))
+    with _PROJECTORS_LOCK:
+        proj = _PROJECTORS.get(key)
+        if proj is None:
+            proj = _PROJECTORS[key] = StreamingPCA2D(int(dim))
+        return proj
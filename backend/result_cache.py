@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Tuple
+
+import numpy as np
+from PIL import Image
+
+
+# In-memory tier budget in bytes (0 disables the cache entirely)
+RESULT_CACHE_BYTES = int(os.environ.get("RESULT_CACHE_BYTES", str(32 * 1024 * 1024)))
+# Optional on-disk SQLite tier; empty disables it
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "").strip()
+RESULT_CACHE_DISK_MAX = int(os.environ.get("RESULT_CACHE_DISK_MAX", "10000"))
+
+
+def image_key(pil_img: Image.Image, model: str) -> str:
+    """Content address for a decoded image under a given model."""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{model}|{pil_img.mode}|{pil_img.size[0]}x{pil_img.size[1]}|".encode())
+    h.update(pil_img.tobytes())
+    return h.hexdigest()
+
+
+def _entry_size(value: Dict[str, Any]) -> int:
+    png = value.get('heatmap_png_b64') or ''
+    cams = value.get('cams')
+    extra = cams.nbytes if cams is not None else 0
+    return len(png) + value['embedding'].nbytes + value['cam'].nbytes + extra + 64 * len(value['topk']) + 256
+
+
+class ResultCache:
+    """Two-tier cache of analyze results keyed by `image_key()`.
+
+    Values are dicts with 'topk' [(label, p)], 'embedding' (float32 [D]),
+    'cam' (float32 CAM grid), optionally 'cams' ([K, H, W] CAMs of the top-K
+    classes, when they were requested) and 'heatmap_png_b64' (None until a
+    PNG overlay was rendered for that image). The memory tier is an LRU bounded by total
+    bytes; the optional disk tier is a small SQLite file that survives
+    restarts and is promoted into memory on hit. Disk reads and writes hold
+    their own lock, never the memory-tier one, so memory hits don't wait on
+    SQLite.
+    """
+
+    def __init__(self, max_bytes: int = RESULT_CACHE_BYTES, path: str = RESULT_CACHE_PATH,
+                 disk_max: int = RESULT_CACHE_DISK_MAX):
+        self.max_bytes = max_bytes
+        self.disk_max = disk_max
+        self._mem: "OrderedDict[str, Tuple[Dict[str, Any], int]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._disk: sqlite3.Connection | None = None
+        self._disk_lock = threading.Lock()
+        # Upper bound on the disk rows (replaced keys count twice); recounted only when over disk_max
+        self._disk_n = 0
+        if path and max_bytes > 0:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute("PRAGMA journal_mode=WAL")
+            self._disk.execute(
+                "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, topk TEXT, heatmap TEXT, "
+                "embedding BLOB, created REAL, cam BLOB, cam_h INTEGER, cam_w INTEGER)"
+            )
+            cols = {r[1] for r in self._disk.execute("PRAGMA table_info(results)")}
+            for name, decl in (('cam', 'BLOB'), ('cam_h', 'INTEGER'), ('cam_w', 'INTEGER'), ('cam_k', 'INTEGER')):
+                if name not in cols:
+                    self._disk.execute(f"ALTER TABLE results ADD COLUMN {name} {decl}")
+            # Entries from before CAM grids were cached can't serve grid requests
+            self._disk.execute("DELETE FROM results WHERE cam IS NULL")
+            self._disk.commit()
+            self._disk_n = self._disk.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def get(self, key: str) -> Dict[str, Any] | None:
+        if not self.enabled:
+            return None
+        with self._lock:
+            hit = self._mem.get(key)
+            if hit is not None:
+                self._mem.move_to_end(key)
+                self.hits += 1
+                return hit[0]
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._mem_put(key, value)
+        return value
+
+    def put(self, key: str, value: Dict[str, Any]):
+        if not self.enabled:
+            return
+        value = dict(
+            value,
+            embedding=np.asarray(value['embedding'], dtype=np.float32),
+            cam=np.asarray(value['cam'], dtype=np.float32),
+        )
+        if value.get('cams') is not None:
+            value['cams'] = np.asarray(value['cams'], dtype=np.float32)
+        with self._lock:
+            self._mem_put(key, value)
+        self._disk_put(key, value)
+
+    def _mem_put(self, key: str, value: Dict[str, Any]):
+        size = _entry_size(value)
+        if size > self.max_bytes:
+            return
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._bytes -= old[1]
+        self._mem[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, s) = self._mem.popitem(last=False)
+            self._bytes -= s
+
+    def _disk_get(self, key: str) -> Dict[str, Any] | None:
+        if self._disk is None:
+            return None
+        with self._disk_lock:
+            row = self._disk.execute(
+                "SELECT topk, heatmap, embedding, cam, cam_h, cam_w, cam_k FROM results WHERE key=?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        # `cam` holds cam_k stacked grids (top-1 first); rows from before cam_k have one
+        cams = np.frombuffer(row[3], dtype=np.float32).reshape(row[6] or 1, row[4], row[5])
+        return {
+            'topk': [tuple(t) for t in json.loads(row[0])],
+            'heatmap_png_b64': row[1],
+            'embedding': np.frombuffer(row[2], dtype=np.float32),
+            'cam': cams[0],
+            'cams': cams if cams.shape[0] > 1 else None,
+        }
+
+    def _disk_put(self, key: str, value: Dict[str, Any]):
+        if self._disk is None:
+            return
+        cams = value['cams'] if value.get('cams') is not None else value['cam'][None]
+        row = (
+            key, json.dumps(value['topk']), value.get('heatmap_png_b64'), value['embedding'].tobytes(),
+            time.time(), cams.tobytes(), int(cams.shape[1]), int(cams.shape[2]), int(cams.shape[0]),
+        )
+        with self._disk_lock:
+            self._disk.execute(
+                "INSERT OR REPLACE INTO results (key, topk, heatmap, embedding, created, cam, cam_h, cam_w, cam_k) "
+                "VALUES (?,?,?,?,?,?,?,?,?)",
+                row,
+            )
+            self._disk_n += 1
+            if self._disk_n > self.disk_max:
+                n = self._disk.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                if n > self.disk_max:
+                    # Trim the oldest tenth in one statement rather than one row per insert
+                    trim = n - self.disk_max + self.disk_max // 10
+                    self._disk.execute(
+                        "DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY created ASC LIMIT ?)",
+                        (trim,),
+                    )
+                    n -= trim
+                self._disk_n = n
+            self._disk.commit()
+
+
+result_cache = ResultCache()
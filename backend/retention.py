@@ -0,0 +1,152 @@
+import argparse
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from perf import span
+from storage import db, delete_predictions, embedding_matrix, expired_predictions, incremental_vacuum
+from vector_index import loaded_index
+
+
+# Predictions older than this many seconds are moved to archives (0 = keep everything in the DB)
+RETENTION_TTL = float(os.environ.get('RETENTION_TTL', '0'))
+# Seconds between compaction passes
+RETENTION_INTERVAL = max(1.0, float(os.environ.get('RETENTION_INTERVAL', '3600')))
+# Rows per archive chunk / delete transaction; bounds memory and writer lock time
+RETENTION_CHUNK = max(1, int(os.environ.get('RETENTION_CHUNK', '5000')))
+# Free pages returned to the OS after each pass
+RETENTION_VACUUM_PAGES = int(os.environ.get('RETENTION_VACUUM_PAGES', '2000'))
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', 'archive')
+
+log = logging.getLogger(__name__)
+
+_THREAD: threading.Thread | None = None
+_LAST: Dict[str, float] = {}
+
+
+def archive_path(archive_dir: str, model: str | None, dim: int, ts0: float, first_id: str) -> str:
+    # <dir>/<model>/d<dim>/<UTC day>/<first ms>-<first id>.npz; rerunning an
+    # interrupted chunk rewrites the same file instead of duplicating it
+    safe = re.sub(r'[^A-Za-z0-9_.-]', '_', model or 'unknown')
+    day = time.strftime('%Y-%m-%d', time.gmtime(ts0))
+    return os.path.join(archive_dir, safe, f'd{dim}', day, f'{int(ts0 * 1000)}-{first_id}.npz')
+
+
+def write_archive(path: str, rows: List, dim: int):
+    """One compressed columnar .npz: `embeddings` float32 [N, dim] plus one
+    array per scalar column ('' for missing strings). Written atomically."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez_compressed(
+            f,
+            ids=np.array([r['id'] for r in rows]),
+            labels=np.array([r['predicted_label'] or '' for r in rows]),
+            probs=np.array([r['predicted_prob'] or 0.0 for r in rows], dtype=np.float32),
+            timestamps=np.array([r['timestamp'] or 0.0 for r in rows], dtype=np.float64),
+            true_labels=np.array([r['true_label'] or '' for r in rows]),
+            users=np.array([r['user'] or '' for r in rows]),
+            thumb_ids=np.array([r['thumb_id'] or '' for r in rows]),
+            embeddings=embedding_matrix([r['embedding_f32'] or b'' for r in rows], dim),
+        )
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def compact(ttl: float = RETENTION_TTL, now: float | None = None, chunk: int = RETENTION_CHUNK,
+            archive_dir: str = ARCHIVE_DIR) -> Dict[str, float]:
+    """Move predictions older than `ttl` seconds into per-model .npz archives.
+
+    Works through the expired rows oldest first, `chunk` at a time. Each chunk
+    is split by (model, dim, day), written to disk, and only then deleted from
+    the DB, together with thumbnails nothing else references. Archived ids
+    are dropped from any loaded neighbor index once, at the end of the pass.
+    Metrics rollups are kept.
+    """
+    if ttl <= 0:
+        return {}
+    cutoff = (now if now is not None else time.time()) - ttl
+    archived = files = 0
+    # Only ids the loaded indexes hold, so this stays bounded by their capacity
+    evict: Dict[Tuple[str | None, int], List[str]] = {}
+    with span('retention_compact'):
+        while True:
+            rows = expired_predictions(cutoff, chunk)
+            if not rows:
+                break
+            parts: Dict[Tuple[str | None, int, str], List] = {}
+            for r in rows:
+                day = time.strftime('%Y-%m-%d', time.gmtime(r['timestamp'] or 0.0))
+                parts.setdefault((r['model'], int(r['emb_dim'] or 0), day), []).append(r)
+            for (model, dim, _), group in parts.items():
+                write_archive(archive_path(archive_dir, model, dim, group[0]['timestamp'] or 0.0, group[0]['id']),
+                              group, dim)
+                files += 1
+            ids = [r['id'] for r in rows]
+            archived += delete_predictions(ids)
+            for (model, dim, _), group in parts.items():
+                idx = loaded_index(model, dim)
+                if idx is not None:
+                    evict.setdefault((model, dim), []).extend(r['id'] for r in group if r['id'] in idx)
+            if len(rows) < chunk:
+                break
+        for (model, dim), gone in evict.items():
+            if gone:
+                loaded_index(model, dim).remove(gone)
+        free = incremental_vacuum(RETENTION_VACUUM_PAGES) if archived else None
+    _LAST.update({'ran_at': time.time(), 'cutoff': cutoff, 'archived': archived, 'files': files})
+    if free is not None:
+        _LAST['free_pages'] = free
+    return dict(_LAST)
+
+
+def status() -> Dict[str, float] | None:
+    """Result of the last compaction pass, or None when retention is off."""
+    if RETENTION_TTL <= 0:
+        return None
+    return dict(_LAST)
+
+
+def _loop(interval: float):
+    while True:
+        try:
+            compact()
+        except Exception:  # keep the compactor alive; the next pass retries the same rows
+            log.exception('compaction failed')
+        time.sleep(interval)
+
+
+def start_compactor(interval: float = RETENTION_INTERVAL) -> threading.Thread | None:
+    """Run compact() every `interval` seconds in a daemon thread, if RETENTION_TTL is set."""
+    global _THREAD
+    if RETENTION_TTL <= 0 or _THREAD is not None:
+        return _THREAD
+    _THREAD = threading.Thread(target=_loop, args=(interval,), name='retention', daemon=True)
+    _THREAD.start()
+    return _THREAD
+
+
+def main(argv: List[str] | None = None):
+    ap = argparse.ArgumentParser(description='Archive and delete old predictions once, then exit.')
+    ap.add_argument('--ttl', type=float, default=RETENTION_TTL, help='age in seconds (default RETENTION_TTL)')
+    ap.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    ap.add_argument('--vacuum', action='store_true',
+                    help='switch an existing DB to incremental auto-vacuum with one full VACUUM (blocks writers)')
+    args = ap.parse_args(argv)
+    if args.vacuum:
+        with db() as conn:
+            conn.commit()
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("VACUUM")
+    print(json.dumps(compact(args.ttl, archive_dir=args.archive_dir)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,561 @@
+import os
+import time
+import base64
+import hashlib
+import queue
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+
+DB_PATH = os.environ.get('DB_PATH', 'data.db')
+# Idle connections kept for reuse; extra connections are opened under load and closed on release
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+# Width of the metrics rollup time buckets in seconds; /metrics/summary ranges resolve to whole buckets
+METRICS_BUCKET_SECONDS = max(1, int(os.environ.get('METRICS_BUCKET_SECONDS', '3600')))
+
+# Bound parameters per statement; older SQLite builds cap them at 999
+SQL_MAX_VARS = 500
+
+_POOL: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue(maxsize=max(1, DB_POOL_SIZE))
+
+_PRAGMAS = (
+    # Must precede WAL to apply to a new file: retention frees pages in small steps, not a blocking VACUUM
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",      # readers don't block the writer and vice versa
+    "PRAGMA synchronous=NORMAL",    # durable at checkpoints; safe with WAL
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",     # ~16 MB page cache per connection
+    "PRAGMA mmap_size=67108864",
+)
+
+
+def _connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    for pragma in _PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+@contextmanager
+def db() -> Iterator[sqlite3.Connection]:
+    """Check out a pooled connection for one unit of work.
+
+    Commits on success and rolls back on error, then returns the connection
+    to the pool instead of closing it.
+    """
+    try:
+        conn = _POOL.get_nowait()
+    except queue.Empty:
+        conn = _connect()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        try:
+            _POOL.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+
+def init_db():
+    with db() as conn:
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS predictions (
+                id TEXT PRIMARY KEY,
+                predicted_label TEXT,
+                predicted_prob REAL,
+                timestamp REAL,
+                user TEXT,
+                true_label TEXT,
+                embedding TEXT,
+                emb2d_x REAL,
+                emb2d_y REAL,
+                thumb_b64 TEXT,
+                embedding_f32 BLOB,
+                emb_dim INTEGER,
+                model TEXT,
+                emb2d_ts REAL,
+                thumb_id TEXT
+            )
+            """
+        )
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS thumbs (
+                id TEXT PRIMARY KEY,
+                mime TEXT NOT NULL,
+                data BLOB NOT NULL
+            )
+            """
+        )
+        migrate_embeddings(conn)
+        migrate_points(conn)
+        migrate_thumbs(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_timestamp ON predictions (timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_group ON predictions (model, emb_dim, timestamp)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_points ON predictions (model, emb_dim, emb2d_ts, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_predictions_thumb ON predictions (thumb_id)")
+        init_metrics(conn)
+
+
+def init_metrics(conn: sqlite3.Connection):
+    """Create the metrics rollup table and backfill it from existing rows.
+
+    One row per (time bucket, model, predicted label, true label) holds a
+    count; '' stands for no model / no feedback yet. Inserts and feedback keep
+    it current, so summaries never scan the predictions table.
+    """
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='metrics_rollup'").fetchone()
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS metrics_rollup (
+            bucket INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            predicted_label TEXT NOT NULL,
+            true_label TEXT NOT NULL,
+            n INTEGER NOT NULL,
+            PRIMARY KEY (bucket, model, predicted_label, true_label)
+        ) WITHOUT ROWID
+        """
+    )
+    if not exists:
+        conn.execute(
+            "INSERT INTO metrics_rollup (bucket, model, predicted_label, true_label, n) "
+            "SELECT CAST(timestamp / ? AS INTEGER) * ?, COALESCE(model, ''), COALESCE(predicted_label, ''), "
+            "COALESCE(true_label, ''), COUNT(*) FROM predictions GROUP BY 1, 2, 3, 4",
+            (METRICS_BUCKET_SECONDS, METRICS_BUCKET_SECONDS),
+        )
+
+
+def _bucket(ts: float) -> int:
+    return int(ts // METRICS_BUCKET_SECONDS) * METRICS_BUCKET_SECONDS
+
+
+def _bump_metrics(conn: sqlite3.Connection, deltas: Dict[Tuple[int, str, str, str], int]):
+    conn.executemany(
+        "INSERT INTO metrics_rollup (bucket, model, predicted_label, true_label, n) VALUES (?,?,?,?,?) "
+        "ON CONFLICT (bucket, model, predicted_label, true_label) DO UPDATE SET n = n + excluded.n",
+        [(*key, d) for key, d in deltas.items() if d],
+    )
+
+
+def migrate_embeddings(conn: sqlite3.Connection, chunk: int = 500):
+    """Upgrade older data.db files to float32 BLOB embeddings.
+
+    Adds the `embedding_f32`/`emb_dim`/`model` columns if missing, then moves
+    comma-joined TEXT embeddings into BLOBs in chunks and clears the TEXT copy.
+    Legacy rows keep `model` NULL since the producing model was not recorded.
+    """
+    cur = conn.cursor()
+    cols = {r['name'] for r in cur.execute("PRAGMA table_info(predictions)")}
+    for name, decl in (('embedding_f32', 'BLOB'), ('emb_dim', 'INTEGER'), ('model', 'TEXT')):
+        if name not in cols:
+            cur.execute(f"ALTER TABLE predictions ADD COLUMN {name} {decl}")
+    conn.commit()
+    while True:
+        rows = cur.execute(
+            "SELECT id, embedding FROM predictions WHERE embedding IS NOT NULL AND embedding_f32 IS NULL LIMIT ?",
+            (chunk,),
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for r in rows:
+            try:
+                vec = np.array(r['embedding'].split(','), dtype=np.float32)
+            except ValueError:
+                vec = np.zeros(0, dtype=np.float32)
+            updates.append((vec.tobytes(), int(vec.shape[0]), r['id']))
+        cur.executemany(
+            "UPDATE predictions SET embedding_f32=?, emb_dim=?, embedding=NULL WHERE id=?",
+            updates,
+        )
+        conn.commit()
+
+
+def migrate_points(conn: sqlite3.Connection):
+    """Add `emb2d_ts` (when the 2D coords were last written) for delta sync of
+    /embeddings/points; existing coords count as written at insert time."""
+    cols = {r['name'] for r in conn.execute("PRAGMA table_info(predictions)")}
+    if 'emb2d_ts' not in cols:
+        conn.execute("ALTER TABLE predictions ADD COLUMN emb2d_ts REAL")
+        conn.execute("UPDATE predictions SET emb2d_ts=timestamp WHERE emb2d_x IS NOT NULL")
+        conn.commit()
+
+
+def thumb_id(data: bytes) -> str:
+    # Content address: identical thumbnails are stored once
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _decode_data_uri(uri: str) -> Tuple[str, bytes]:
+    header, _, b64 = uri.partition(',')
+    return (header[len('data:'):].split(';')[0] or 'image/jpeg'), base64.b64decode(b64)
+
+
+def migrate_thumbs(conn: sqlite3.Connection, chunk: int = 500):
+    """Move inline `thumb_b64` data URIs into the content-addressed `thumbs`
+    table, leaving only a `thumb_id` reference on each prediction row."""
+    cur = conn.cursor()
+    cols = {r['name'] for r in cur.execute("PRAGMA table_info(predictions)")}
+    if 'thumb_id' not in cols:
+        cur.execute("ALTER TABLE predictions ADD COLUMN thumb_id TEXT")
+    conn.commit()
+    while True:
+        rows = cur.execute(
+            "SELECT id, thumb_b64 FROM predictions WHERE thumb_b64 IS NOT NULL LIMIT ?", (chunk,)
+        ).fetchall()
+        if not rows:
+            break
+        blobs, refs = {}, []
+        for r in rows:
+            try:
+                mime, data = _decode_data_uri(r['thumb_b64'])
+            except ValueError:
+                refs.append((None, r['id']))
+                continue
+            tid = thumb_id(data)
+            blobs[tid] = (tid, mime, data)
+            refs.append((tid, r['id']))
+        cur.executemany("INSERT OR IGNORE INTO thumbs (id, mime, data) VALUES (?,?,?)", list(blobs.values()))
+        cur.executemany("UPDATE predictions SET thumb_id=?, thumb_b64=NULL WHERE id=?", refs)
+        conn.commit()
+
+
+def insert_predictions(preds: List[Dict]):
+    """Bulk insert in one transaction.
+
+    Each dict has `pid`, `label`, `prob`, `embedding`, `emb2d` (or None) and
+    optionally `user` and `model`. The thumbnail is given as encoded image
+    bytes in `thumb` (plus `thumb_mime`, default JPEG) and stored once per
+    distinct content in `thumbs`.
+    """
+    now = time.time()
+    params = []
+    thumbs = {}
+    deltas: Dict[Tuple[int, str, str, str], int] = {}
+    for p in preds:
+        key = (_bucket(now), p.get('model') or '', p['label'] or '', '')
+        deltas[key] = deltas.get(key, 0) + 1
+        emb = np.ascontiguousarray(p['embedding'], dtype=np.float32).reshape(-1)
+        emb2d = p.get('emb2d')
+        tid = thumb_id(p['thumb'])
+        thumbs[tid] = (tid, p.get('thumb_mime') or 'image/jpeg', p['thumb'])
+        params.append((
+            p['pid'],
+            p['label'],
+            float(p['prob']),
+            now,
+            p.get('user') or 'demo',
+            None,
+            emb.tobytes(),
+            int(emb.shape[0]),
+            p.get('model'),
+            float(emb2d[0]) if emb2d else None,
+            float(emb2d[1]) if emb2d else None,
+            now if emb2d else None,
+            tid,
+        ))
+    with db() as conn:
+        conn.executemany("INSERT OR IGNORE INTO thumbs (id, mime, data) VALUES (?,?,?)", list(thumbs.values()))
+        conn.executemany(
+            "INSERT INTO predictions (id, predicted_label, predicted_prob, timestamp, user, true_label, embedding_f32, emb_dim, model, emb2d_x, emb2d_y, emb2d_ts, thumb_id) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)",
+            params,
+        )
+        _bump_metrics(conn, deltas)
+
+
+def update_emb2d(ids: List[str], coords: np.ndarray):
+    now = time.time()
+    with db() as conn:
+        conn.executemany(
+            "UPDATE predictions SET emb2d_x=?, emb2d_y=?, emb2d_ts=? WHERE id=?",
+            [(float(x), float(y), now, pid) for pid, (x, y) in zip(ids, coords)],
+        )
+
+
+def clear_emb2d_before(model: str | None, dim: int, before: float):
+    """Mark coords of a group's rows older than `before` stale after a re-fit
+    that didn't cover them; they are re-projected with the current basis when
+    next shown, and the bumped emb2d_ts sends them to delta clients."""
+    with db() as conn:
+        conn.execute(
+            "UPDATE predictions SET emb2d_x=NULL, emb2d_y=NULL, emb2d_ts=? "
+            "WHERE model IS ? AND emb_dim=? AND timestamp < ? AND emb2d_x IS NOT NULL",
+            (time.time(), model, dim, before),
+        )
+
+
+def update_feedback(pid: str, true_label: str):
+    with db() as conn:
+        row = conn.execute(
+            "SELECT timestamp, model, predicted_label, true_label FROM predictions WHERE id=?", (pid,)
+        ).fetchone()
+        if row is None or row['true_label'] == true_label:
+            return
+        conn.execute("UPDATE predictions SET true_label=? WHERE id=?", (true_label, pid))
+        # Move the row's count from its old (true label) cell to the new one
+        key = (_bucket(row['timestamp'] or 0.0), row['model'] or '', row['predicted_label'] or '')
+        _bump_metrics(conn, {(*key, row['true_label'] or ''): -1, (*key, true_label): 1})
+
+
+def metrics_counts(model: str | None = None, since: float | None = None,
+                   until: float | None = None) -> List[Tuple[str, str, int]]:
+    """(predicted label, true label or '', count) over the rollup buckets
+    overlapping [since, until), optionally for one model."""
+    where, args = [], []
+    if since is not None:
+        where.append("bucket >= ?")
+        args.append(_bucket(since))
+    if until is not None:
+        where.append("bucket < ?")
+        args.append(_bucket(until) + METRICS_BUCKET_SECONDS)
+    if model is not None:
+        where.append("model = ?")
+        args.append(model)
+    sql = "SELECT predicted_label, true_label, SUM(n) AS n FROM metrics_rollup"
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " GROUP BY predicted_label, true_label HAVING SUM(n) > 0"
+    with db() as conn:
+        return [(r['predicted_label'], r['true_label'], int(r['n'])) for r in conn.execute(sql, args)]
+
+
+def last_n_embeddings(n: int, model: str | None, dim: int) -> Tuple[List[sqlite3.Row], np.ndarray]:
+    """Most recent `n` rows for one (model, dim) group in chronological order,
+    plus their embeddings as a single contiguous float32 [N, dim] matrix."""
+    with db() as conn:
+        rows = conn.execute(
+            "SELECT id, predicted_label, timestamp, emb2d_x, emb2d_y, thumb_id, embedding_f32 FROM predictions "
+            "WHERE model IS ? AND emb_dim=? ORDER BY timestamp DESC LIMIT ?",
+            (model, dim, n),
+        ).fetchall()
+    rows = list(reversed(rows))
+    return rows, embedding_matrix([r['embedding_f32'] for r in rows], dim)
+
+
+def embedding_points(
+    model: str | None,
+    dim: int,
+    limit: int,
+    cursor: Tuple[float, str] | None = None,
+    bbox: Tuple[float, float, float, float] | None = None,
+) -> Tuple[List[sqlite3.Row], Tuple[float, str] | None, bool]:
+    """Scatter-plot columns (id, label, timestamp, coords) for one (model, dim) group.
+
+    Without a cursor: the newest `limit` rows in chronological order, some
+    possibly without coords yet. With a cursor (emb2d_ts, id): rows whose
+    coords were written after it, oldest change first, so a client can page
+    through updates. `bbox` (x0, y0, x1, y1) keeps only points inside it.
+    Returns (rows, cursor to resume from, whether more changes are pending).
+    """
+    where = "model IS ? AND emb_dim=?"
+    args: list = [model, dim]
+    if bbox is not None:
+        where += " AND emb2d_x BETWEEN ? AND ? AND emb2d_y BETWEEN ? AND ?"
+        args += [bbox[0], bbox[2], bbox[1], bbox[3]]
+    cols = "id, predicted_label, timestamp, emb2d_x, emb2d_y, emb2d_ts, thumb_id"
+    with db() as conn:
+        if cursor is None:
+            # Read the resume point first; changes racing with the query are re-sent, never lost
+            last = conn.execute(
+                "SELECT emb2d_ts, id FROM predictions WHERE model IS ? AND emb_dim=? AND emb2d_ts IS NOT NULL "
+                "ORDER BY emb2d_ts DESC, id DESC LIMIT 1",
+                (model, dim),
+            ).fetchone()
+            rows = conn.execute(
+                f"SELECT {cols} FROM predictions WHERE {where} ORDER BY timestamp DESC LIMIT ?",
+                args + [limit],
+            ).fetchall()
+            return list(reversed(rows)), ((last['emb2d_ts'], last['id']) if last else None), False
+        rows = conn.execute(
+            f"SELECT {cols} FROM predictions WHERE {where} AND (emb2d_ts, id) > (?, ?) "
+            "ORDER BY emb2d_ts, id LIMIT ?",
+            args + [cursor[0], cursor[1], limit],
+        ).fetchall()
+    nxt = (rows[-1]['emb2d_ts'], rows[-1]['id']) if rows else cursor
+    return rows, nxt, len(rows) == limit
+
+
+def get_thumb(tid: str) -> Tuple[str, bytes] | None:
+    """(mime type, image bytes) for a thumb id; a prediction id is also accepted."""
+    with db() as conn:
+        row = conn.execute("SELECT mime, data FROM thumbs WHERE id=?", (tid,)).fetchone()
+        if row is None:
+            row = conn.execute(
+                "SELECT t.mime, t.data FROM predictions p JOIN thumbs t ON t.id = p.thumb_id WHERE p.id=?", (tid,)
+            ).fetchone()
+    return (row['mime'], row['data']) if row else None
+
+
+def embedding_matrix(blobs: List[bytes], dim: int) -> np.ndarray:
+    # One join + frombuffer: no per-float parsing, rows are views into one buffer
+    if not blobs:
+        return np.zeros((0, dim), dtype=np.float32)
+    return np.frombuffer(b''.join(blobs), dtype=np.float32).reshape(len(blobs), dim)
+
+
+def get_group(pid: str) -> Tuple[str | None, int] | None:
+    with db() as conn:
+        row = conn.execute("SELECT model, emb_dim FROM predictions WHERE id=?", (pid,)).fetchone()
+    if row is None or not row['emb_dim']:
+        return None
+    return row['model'], int(row['emb_dim'])
+
+
+def most_common_group(n: int, model: str | None = None) -> Tuple[str | None, int] | None:
+    """The most common (model, embedding dim) among the last `n` rows,
+    optionally restricted to one model."""
+    with db() as conn:
+        row = conn.execute(
+            "SELECT model, emb_dim, COUNT(*) AS n FROM "
+            "(SELECT model, emb_dim FROM predictions WHERE emb_dim > 0 ORDER BY timestamp DESC LIMIT ?) "
+            "WHERE ? IS NULL OR model = ? GROUP BY model, emb_dim ORDER BY n DESC LIMIT 1",
+            (n, model, model),
+        ).fetchone()
+    if row is None:
+        return None
+    return row['model'], int(row['emb_dim'])
+
+
+def iter_group_embeddings(model: str | None, dim: int, limit: int, chunk: int = 2000) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Stream (ids, [N, dim] float32) chunks for the newest `limit` rows of a
+    (model, dim) group in chronological order, without materializing them all."""
+    with db() as conn:
+        cur = conn.execute(
+            "SELECT id, embedding_f32 FROM "
+            "(SELECT id, embedding_f32, timestamp FROM predictions WHERE model IS ? AND emb_dim=? "
+            "ORDER BY timestamp DESC LIMIT ?) ORDER BY timestamp ASC",
+            (model, dim, limit),
+        )
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            yield [r['id'] for r in rows], embedding_matrix([r['embedding_f32'] for r in rows], dim)
+
+
+def _export_range(since: float | None, until: float | None) -> Tuple[str, List]:
+    rng, args = "", []
+    if since is not None:
+        rng += " AND timestamp >= ?"
+        args.append(since)
+    if until is not None:
+        rng += " AND timestamp < ?"
+        args.append(until)
+    return rng, args
+
+
+def export_stats(model: str | None, dim: int | None = None, since: float | None = None,
+                 until: float | None = None) -> Dict:
+    """Size up a (model, dim) group within [since, until) for an export.
+
+    Returns the row count `n`, the resolved `dim` and the widest
+    id/label/true label in UTF-8 bytes. Without `dim`, the most common one in
+    the range is used.
+    """
+    rng, rng_args = _export_range(since, until)
+    with db() as conn:
+        if dim is None:
+            row = conn.execute(
+                f"SELECT emb_dim, COUNT(*) AS n FROM predictions WHERE model IS ? AND emb_dim > 0{rng} "
+                "GROUP BY emb_dim ORDER BY n DESC LIMIT 1",
+                [model] + rng_args,
+            ).fetchone()
+            dim = int(row['emb_dim']) if row else 0
+        row = conn.execute(
+            "SELECT COUNT(*) AS n, MAX(LENGTH(CAST(id AS BLOB))) AS id_len, "
+            "MAX(LENGTH(CAST(predicted_label AS BLOB))) AS label_len, "
+            f"MAX(LENGTH(CAST(true_label AS BLOB))) AS true_len FROM predictions WHERE model IS ? AND emb_dim=?{rng}",
+            [model, dim] + rng_args,
+        ).fetchone()
+    return {
+        'n': int(row['n']), 'dim': dim,
+        'id_len': row['id_len'] or 0, 'label_len': row['label_len'] or 0, 'true_len': row['true_len'] or 0,
+    }
+
+
+def export_page(model: str | None, dim: int, since: float | None, until: float | None,
+                after: Tuple[float, int] | None, limit: int) -> List[sqlite3.Row]:
+    """Up to `limit` rows of an export, oldest first, after the (timestamp,
+    rowid) key of the previous page. Each page is its own short read, so a
+    slow reader never pins a WAL snapshot."""
+    rng, args = _export_range(since, until)
+    if after is not None:
+        rng += " AND (timestamp, rowid) > (?, ?)"
+        args += list(after)
+    with db() as conn:
+        # (timestamp, rowid) matches the index order, so no temp sort is built
+        return conn.execute(
+            "SELECT rowid, id, predicted_label, true_label, predicted_prob, timestamp, embedding_f32 FROM predictions "
+            f"WHERE model IS ? AND emb_dim=?{rng} ORDER BY timestamp, rowid LIMIT ?",
+            [model, dim] + args + [limit],
+        ).fetchall()
+
+
+def expired_predictions(cutoff: float, limit: int) -> List[sqlite3.Row]:
+    """The oldest `limit` rows stamped before `cutoff`, oldest first, with
+    every column the retention archive keeps."""
+    with db() as conn:
+        return conn.execute(
+            "SELECT id, predicted_label, predicted_prob, timestamp, user, true_label, embedding_f32, emb_dim, "
+            "model, thumb_id FROM predictions WHERE timestamp < ? ORDER BY timestamp, id LIMIT ?",
+            (cutoff, limit),
+        ).fetchall()
+
+
+def delete_predictions(ids: List[str]) -> int:
+    """Delete rows and any thumbnails no remaining row references.
+
+    Metrics rollups are left alone, so /metrics/summary still counts them.
+    """
+    if not ids:
+        return 0
+    ids, tids, n = list(ids), set(), 0
+    with db() as conn:
+        for s in range(0, len(ids), SQL_MAX_VARS):
+            part = ids[s:s + SQL_MAX_VARS]
+            marks = ','.join('?' * len(part))
+            tids.update(r['thumb_id'] for r in conn.execute(
+                f"SELECT DISTINCT thumb_id FROM predictions WHERE id IN ({marks}) AND thumb_id IS NOT NULL", part
+            ))
+            n += conn.execute(f"DELETE FROM predictions WHERE id IN ({marks})", part).rowcount
+        conn.executemany(
+            "DELETE FROM thumbs WHERE id=? AND NOT EXISTS (SELECT 1 FROM predictions WHERE thumb_id=?)",
+            [(t, t) for t in tids],
+        )
+    return n
+
+
+def incremental_vacuum(pages: int) -> int:
+    """Return up to `pages` free pages to the OS; no-op unless the file uses
+    auto_vacuum=INCREMENTAL. Returns the free pages left."""
+    with db() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            # executescript steps the pragma to completion; execute() frees a single page
+            conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+        return int(conn.execute("PRAGMA freelist_count").fetchone()[0])
+
+
+def get_predictions(ids: List[str]) -> Dict[str, sqlite3.Row]:
+    """Neighbor-card columns (plus embedding) for the given ids, keyed by id."""
+    ids, out = list(ids), {}
+    with db() as conn:
+        for s in range(0, len(ids), SQL_MAX_VARS):
+            part = ids[s:s + SQL_MAX_VARS]
+            marks = ','.join('?' * len(part))
+            out.update((r['id'], r) for r in conn.execute(
+                "SELECT id, predicted_label, emb2d_x, emb2d_y, thumb_id, embedding_f32 FROM predictions "
+                f"WHERE id IN ({marks})",
+                part,
+            ))
+    return out
@@ -0,0 +1,47 @@
+import queue
+
+import numpy as np
+import pytest
+
+from projection import StreamingPCA2D
+
+
+def test_single_row_fit_does_not_freeze_scale():
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(20, 16))
+    proj = StreamingPCA2D(16)
+    Z = proj.fit(X[:1])
+    assert np.allclose(Z, 0.0)
+    assert not proj.scaled.any()
+    Z = proj.fit(X[:20])
+    assert proj.scaled.all()
+    assert np.max(np.abs(Z)) <= 1.0 + 1e-9
+    assert np.max(np.abs(proj.transform(X[:20]))) <= 1.0 + 1e-9
+
+
+def test_store_predictions_from_empty_db(tmp_path, monkeypatch):
+    pytest.importorskip('torch')
+    pytest.importorskip('flask')
+    from PIL import Image
+
+    # Importing app runs init_db() on the default DB_PATH; keep that out of the tree
+    monkeypatch.chdir(tmp_path)
+
+    import app
+    import projection
+    import storage
+
+    monkeypatch.setattr(storage, 'DB_PATH', str(tmp_path / 'empty.db'))
+    monkeypatch.setattr(storage, '_POOL', queue.LifoQueue(maxsize=1))
+    monkeypatch.setattr(projection, '_PROJECTORS', {})
+    storage.init_db()
+
+    rng = np.random.default_rng(0)
+    img = Image.new('RGB', (32, 32))
+    coords = []
+    for _ in range(10):
+        res = {'embedding': rng.normal(size=32).astype(np.float32), 'topk': [('cat', 0.9)]}
+        coords += [out['emb2d'] for out in app.store_predictions('test-empty-db', [img], [res], None)]
+    assert np.max(np.abs(np.array(coords))) < 10.0
+    rows, _ = storage.last_n_embeddings(10, 'test-empty-db', 32)
+    assert all(abs(r['emb2d_x']) < 10.0 and abs(r['emb2d_y']) < 10.0 for r in rows)
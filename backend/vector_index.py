@@ -0,0 +1,241 @@
+import os
+import threading
+from array import array
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+
+# Most recent items kept per (model, dim) index; older ones are dropped first
+ANN_MAX_ITEMS = int(os.environ.get("ANN_MAX_ITEMS", "50000"))
+# Vector memory cap per index; lowers the item cap for high-dimension groups (0 = none)
+ANN_MAX_BYTES = int(float(os.environ.get("ANN_MAX_MB", "128")) * 1024 * 1024)
+# Switch from exact search to an inverted-file (IVF) index above this size
+ANN_IVF_MIN = int(os.environ.get("ANN_IVF_MIN", "4096"))
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "8"))
+
+
+def max_items_for(dim: int) -> int:
+    """Items kept for a `dim`-sized group: ANN_MAX_ITEMS, capped by ANN_MAX_BYTES."""
+    if ANN_MAX_BYTES <= 0 or dim <= 0:
+        return max(1, ANN_MAX_ITEMS)
+    return max(1, min(ANN_MAX_ITEMS, ANN_MAX_BYTES // (4 * dim)))
+
+
+def _normalize(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    norms = np.linalg.norm(X, axis=1, keepdims=True)
+    return X / np.maximum(norms, 1e-12)
+
+
+class VectorIndex:
+    """In-process cosine-similarity index over float32 embeddings for one (model, dim).
+
+    Vectors are L2-normalized into one growable matrix, so similarity is a
+    single matrix-vector product. Past ANN_IVF_MIN items a coarse k-means
+    quantizer (IVF) restricts each query to the ANN_NPROBE closest cells,
+    which keeps lookups well under a millisecond as history grows. The
+    quantizer is retrained whenever the index has doubled since training,
+    or after rows were dropped. Training runs in a background thread on a
+    snapshot and only takes the lock to sample and to swap the result in;
+    until then queries keep using the current cells, or exact search.
+    """
+
+    def __init__(self, dim: int, max_items: int | None = None, background: bool = True):
+        self.dim = dim
+        self.max_items = max(1, max_items if max_items is not None else max_items_for(dim))
+        self.background = background
+        self.lock = threading.RLock()
+        # Grows by doubling up to exactly max_items rows, never past it
+        self._X = np.zeros((min(1024, self.max_items), dim), dtype=np.float32)
+        self._ids: List[str] = []
+        self._pos: Dict[str, int] = {}
+        self._centroids: np.ndarray | None = None
+        self._lists: List[array] = []
+        self._trained_at = 0
+        # Bumped whenever rows are renumbered, which invalidates a training snapshot
+        self._epoch = 0
+        self._training = False
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, pid: str) -> bool:
+        return pid in self._pos
+
+    def add(self, ids: Iterable[str], X: np.ndarray):
+        ids = list(ids)
+        X = _normalize(np.asarray(X).reshape(len(ids), self.dim))
+        with self.lock:
+            keep = [i for i, pid in enumerate(ids) if pid not in self._pos][-self.max_items:]
+            if not keep:
+                return
+            over = len(self._ids) + len(keep) - self.max_items
+            if over > 0:
+                # Make room first, dropping an extra quarter so eviction cost is amortized
+                self._truncate(min(len(self._ids), over + self.max_items // 4))
+            n0, n1 = len(self._ids), len(self._ids) + len(keep)
+            if n1 > self._X.shape[0]:
+                grown = np.zeros((min(max(n1, 2 * self._X.shape[0]), self.max_items), self.dim), dtype=np.float32)
+                grown[:n0] = self._X[:n0]
+                self._X = grown
+            self._X[n0:n1] = X[keep]
+            for j, i in enumerate(keep):
+                self._pos[ids[i]] = n0 + j
+                self._ids.append(ids[i])
+            if self._centroids is not None:
+                self._assign(np.arange(n0, n1))
+            self._maybe_train()
+
+    def search(self, q: np.ndarray, k: int = 5, exclude: str | None = None) -> List[Tuple[str, float]]:
+        q = _normalize(np.asarray(q).reshape(1, self.dim))[0]
+        with self.lock:
+            n = len(self._ids)
+            if n == 0:
+                return []
+            if self._centroids is not None:
+                cell_scores = self._centroids @ q
+                probe = np.argsort(-cell_scores)[:ANN_NPROBE]
+                cand = np.concatenate([np.frombuffer(self._lists[c], dtype=np.int64) for c in probe])
+            else:
+                cand = np.arange(n)
+            if cand.size == 0:
+                return []
+            scores = self._X[cand] @ q
+            m = min(k + 1, cand.size)
+            top = np.argpartition(-scores, m - 1)[:m]
+            top = top[np.argsort(-scores[top])]
+            out = []
+            for t in top:
+                pid = self._ids[int(cand[t])]
+                if pid == exclude:
+                    continue
+                out.append((pid, float(scores[t])))
+                if len(out) >= k:
+                    break
+            return out
+
+    def remove(self, ids: Iterable[str]) -> int:
+        """Drop the given ids (e.g. archived rows); returns how many were present."""
+        with self.lock:
+            gone = {pid for pid in ids if pid in self._pos}
+            if not gone:
+                return 0
+            keep = [i for i, pid in enumerate(self._ids) if pid not in gone]
+            n = len(keep)
+            self._X[:n] = self._X[keep]
+            self._ids = [self._ids[i] for i in keep]
+            self._pos = {pid: i for i, pid in enumerate(self._ids)}
+            self._invalidate()
+            self._maybe_train()
+            return len(gone)
+
+    def _truncate(self, drop: int):
+        self._X[: len(self._ids) - drop] = self._X[drop: len(self._ids)]
+        self._ids = self._ids[drop:]
+        self._pos = {pid: i for i, pid in enumerate(self._ids)}
+        self._invalidate()
+
+    def _invalidate(self):
+        # Row numbers moved, so the cell lists are stale: exact search until retrained
+        self._epoch += 1
+        self._centroids = None
+        self._lists = []
+        self._trained_at = 0
+
+    def _maybe_train(self):
+        # Caller holds the lock
+        n = len(self._ids)
+        if self._training or n < ANN_IVF_MIN or n < 2 * self._trained_at:
+            return
+        self._training = True
+        if self.background:
+            threading.Thread(target=self._train, name=f'ivf-train-{self.dim}', daemon=True).start()
+        else:
+            self._train()
+
+    def _train(self, iters: int = 8, sample: int = 20000):
+        retry = False
+        try:
+            with self.lock:
+                n, epoch, X = len(self._ids), self._epoch, self._X
+                rng = np.random.default_rng(0)
+                S = X[rng.choice(n, size=min(n, sample), replace=False)]  # a copy
+            nlist = max(1, int(np.sqrt(n)))
+            C = S[rng.choice(S.shape[0], size=nlist, replace=False)].copy()
+            for _ in range(iters):
+                assign = np.argmax(S @ C.T, axis=1)
+                # Per-cell sums as one (one-hot @ samples) product instead of a loop over cells
+                onehot = np.zeros((nlist, S.shape[0]), dtype=np.float32)
+                onehot[assign, np.arange(S.shape[0])] = 1.0
+                sums = onehot @ S
+                filled = onehot.sum(axis=1) > 0
+                C[filled] = sums[filled]
+                C = _normalize(C)
+            # Cells for rows [0, n) without the lock: appends only write past row n
+            # (or into a new buffer), and anything that moves rows bumps the epoch
+            cells = np.concatenate([
+                np.argmax(X[s:min(s + 8192, n)] @ C.T, axis=1) for s in range(0, n, 8192)
+            ]) if n else np.zeros(0, dtype=np.int64)
+            order = np.argsort(cells, kind='stable').astype(np.int64)
+            lists = [array('q', part.tobytes()) for part in np.split(order, np.cumsum(np.bincount(cells, minlength=nlist))[:-1])]
+            with self.lock:
+                if self._epoch != epoch:
+                    retry = True
+                    return
+                self._centroids = C
+                self._lists = lists
+                self._trained_at = n
+                # Rows added while training
+                self._assign(np.arange(n, len(self._ids)))
+        finally:
+            with self.lock:
+                self._training = False
+                if retry:
+                    self._maybe_train()
+
+    def _assign(self, rows: np.ndarray, chunk: int = 8192):
+        for s in range(0, len(rows), chunk):
+            r = rows[s:s + chunk]
+            cells = np.argmax(self._X[r] @ self._centroids.T, axis=1)
+            for i, c in zip(r, cells):
+                self._lists[int(c)].append(int(i))
+
+
+_INDEXES: Dict[Tuple[str | None, int], VectorIndex] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+def loaded_index(model: str | None, dim: int) -> VectorIndex | None:
+    """The (model, dim) index if it has been built, without building it."""
+    with _INDEXES_LOCK:
+        return _INDEXES.get((model, int(dim)))
+
+
+def get_index(
+    model: str | None,
+    dim: int,
+    loader: Callable[[], Iterable[Tuple[List[str], np.ndarray]]] | None = None,
+) -> VectorIndex:
+    """Per-(model, dim) index, built on first use from `loader()` chunks of
+    (ids, [N, dim] embeddings) in chronological order."""
+    key = (model, int(dim))
+    with _INDEXES_LOCK:
+        idx = _INDEXES.get(key)
+        if idx is not None:
+            return idx
+        idx = _INDEXES[key] = VectorIndex(int(dim))
+        # Hold the index lock while loading so queries wait for a complete index
+        idx.lock.acquire()
+    try:
+        if loader is not None:
+            for ids, X in loader():
+                idx.add(ids, X)
+    except Exception:
+        # Don't leave a partially loaded index behind
+        with _INDEXES_LOCK:
+            _INDEXES.pop(key, None)
+        raise
+    finally:
+        idx.lock.release()
+    return idx
@@ -39,7 +39,7 @@ export default function AnalyzingScreen() {
         } catch {
           // Ignore and proceed — the analyze call might still work
         }
-        const res = await analyzeImageAsync(imageUri!, { model: typeof model === 'string' ? model : undefined, signal: controller.signal, timeoutMs: 180000 });
+        const res = await analyzeImageAsync(imageUri!, { model: typeof model === 'string' ? model : undefined, signal: controller.signal, timeoutMs: 180000, heatmapFormat: 'grid', heatmapClasses: 5 });
         if (!alive) return;
         try { await Haptics.notificationAsync(Haptics.NotificationFeedbackType.Success); } catch {}
         try { await notifyAnalysisDone(res.model); } catch {}
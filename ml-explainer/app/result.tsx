@@ -19,6 +19,7 @@ export default function ResultScreen() {
   const { result, imageUri } = useAnalysis();
   const [showOverlay, setShowOverlay] = useState(true);
   const [alpha, setAlpha] = useState(0.9);
+  const [camIndex, setCamIndex] = useState(0);
 
   const suggestions = useMemo(() => (result?.topk ?? []).map((t) => t.label), [result]);
 
@@ -35,7 +36,7 @@ export default function ResultScreen() {
     }
     for (let i = 0; i < (result?.neighbors?.length || 0); i++) {
       const n = result.neighbors[i];
-      pts.push({ id: `nb_${i}`, x: n.x, y: n.y, label: n.label, thumb: n.thumb });
+      pts.push({ id: `nb_${i}`, x: n.x, y: n.y, label: n.label, thumb_url: n.thumb_url ?? undefined });
     }
     return pts;
   }, [result]);
@@ -61,7 +62,24 @@ export default function ResultScreen() {
             <Switch value={showOverlay} onValueChange={setShowOverlay} />
           </View>
         </View>
-        <HeatmapOverlay originalUri={imageUri} overlayDataUri={result.heatmap_png_b64} showOverlay={showOverlay} overlayOpacity={alpha} />
+        {(result.heatmap_grid?.k ?? 1) > 1 && (
+          <ScrollView horizontal showsHorizontalScrollIndicator={false} contentContainerStyle={styles.togglePills}>
+            {result.topk.slice(0, result.heatmap_grid?.k ?? 1).map((t, i) => (
+              <Pressable key={t.label} onPress={() => setCamIndex(i)} style={[styles.pill, camIndex === i && styles.pillActive]}>
+                <Text style={[styles.pillText, camIndex === i && styles.pillTextActive]} numberOfLines={1}>{t.label}</Text>
+              </Pressable>
+            ))}
+          </ScrollView>
+        )}
+        <HeatmapOverlay
+          originalUri={imageUri}
+          overlayDataUri={result.heatmap_png_b64}
+          grid={result.heatmap_grid}
+          classIndex={camIndex}
+          classLabel={(result.heatmap_grid?.k ?? 1) > 1 ? result.topk[camIndex]?.label : undefined}
+          showOverlay={showOverlay}
+          overlayOpacity={alpha}
+        />
         <View style={{ marginTop: 8 }}>
           <Text>Saliency strength</Text>
           <Slider
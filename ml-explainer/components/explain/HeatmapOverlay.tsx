@@ -1,24 +1,47 @@
-import React from 'react';
+import React, { useMemo } from 'react';
 import { View, StyleSheet, Text } from 'react-native';
 import { Image } from 'expo-image';
 
+import type { HeatmapGrid } from '@/lib/api';
+import { gridToPngDataUri } from '@/lib/heatmap';
+
 export default function HeatmapOverlay({
   originalUri,
   overlayDataUri,
+  grid,
+  classIndex = 0,
+  classLabel,
   showOverlay,
   overlayOpacity,
 }: {
   originalUri: string;
-  overlayDataUri: string;
+  overlayDataUri?: string | null;
+  grid?: HeatmapGrid | null;
+  classIndex?: number;
+  classLabel?: string;
   showOverlay: boolean;
   overlayOpacity: number;
 }) {
+  // A compact CAM grid is colorized locally and stretched over the photo's contained rect
+  const gridUri = useMemo(() => (grid ? gridToPngDataUri(grid, 0.9, classIndex) : null), [grid, classIndex]);
+  const aspect = grid?.image_w && grid?.image_h ? grid.image_w / grid.image_h : 1;
+
   return (
     <View>
       <Text style={styles.title}>Grad-CAM</Text>
       <View style={styles.container} pointerEvents="box-none">
         <Image source={{ uri: originalUri }} style={styles.image} contentFit="contain" pointerEvents="none" />
-        {showOverlay && (
+        {showOverlay && gridUri && (
+          <View style={[styles.image, styles.center]} pointerEvents="none">
+            <Image
+              source={{ uri: gridUri }}
+              style={[aspect >= 1 ? { width: '100%' } : { height: '100%' }, { aspectRatio: aspect, opacity: overlayOpacity }]}
+              contentFit="fill"
+              pointerEvents="none"
+            />
+          </View>
+        )}
+        {showOverlay && !gridUri && overlayDataUri && (
           <Image
             source={{ uri: overlayDataUri }}
             style={[styles.image, styles.overlay, { opacity: overlayOpacity }]}
@@ -28,7 +51,9 @@ export default function HeatmapOverlay({
           />
         )}
       </View>
-      <Text style={styles.caption}>Red areas contributed most to this prediction.</Text>
+      <Text style={styles.caption}>
+        {classLabel ? `Red areas contributed most to "${classLabel}".` : 'Red areas contributed most to this prediction.'}
+      </Text>
       <View style={styles.infoBox}>
         <Text style={styles.infoTitle}>What you're seeing</Text>
         <Text style={styles.infoText}>• Grad-CAM highlights image regions that most influenced the top class.</Text>
@@ -51,6 +76,7 @@ const styles = StyleSheet.create({
   },
   image: { ...StyleSheet.absoluteFillObject },
   overlay: {},
+  center: { alignItems: 'center', justifyContent: 'center' },
   caption: { color: '#6b7280', fontSize: 12, marginTop: 6 },
   infoBox: { marginTop: 8, backgroundColor: '#f8fafc', borderColor: '#e5e7eb', borderWidth: 1, borderRadius: 8, padding: 10, gap: 4 },
   infoTitle: { fontWeight: '700' },
@@ -1,9 +1,9 @@
-import React, { useEffect, useMemo, useState } from 'react';
+import React, { useEffect, useMemo, useRef, useState } from 'react';
 import { View, Text, StyleSheet } from 'react-native';
 import { PanGestureHandler, PinchGestureHandler } from 'react-native-gesture-handler';
 import Animated, { useAnimatedGestureHandler, useAnimatedStyle, useSharedValue, withTiming } from 'react-native-reanimated';
 import type { EmbeddingPoint } from '@/lib/api';
-import { getEmbeddingPointsAsync } from '@/lib/api';
+import { getEmbeddingPointsPageAsync } from '@/lib/api';
 
 type Pt = { x: number; y: number };
 
@@ -18,13 +18,25 @@ export default function ZoomableEmbeddingScatter({
   points: providedPoints,
   title = 'Embeddings (all recent)',
   limit,
+  maxPoints = 400,
+  refreshMs = 15000,
+  fullRefreshEvery = 20,
 }: {
   highlightId?: string;
   points?: EmbeddingPoint[];
   title?: string;
   limit?: number;
+  // Server-side level-of-detail cap for the initial load
+  maxPoints?: number;
+  // Delta refresh interval (0 disables)
+  refreshMs?: number;
+  // Every Nth refresh reloads the window so points deleted server-side (retention) drop off
+  fullRefreshEvery?: number;
 }) {
   const [points, setPoints] = useState<EmbeddingPoint[]>(providedPoints ?? []);
+  const cursor = useRef<string | null>(null);
+  // Deltas must come from the same (model) 2D space as the first page
+  const model = useRef<string | undefined>(undefined);
   const size = 280;
 
   useEffect(() => {
@@ -32,15 +44,62 @@ export default function ZoomableEmbeddingScatter({
       setPoints(providedPoints);
       return;
     }
-    (async () => {
+    let cancelled = false;
+    let timer: any;
+    let polls = 0;
+
+    async function load() {
+      try {
+        const res = await getEmbeddingPointsPageAsync({ limit, maxPoints, model: model.current });
+        if (cancelled) return;
+        cursor.current = res.cursor;
+        model.current = res.model ?? model.current;
+        setPoints(res.points);
+      } catch (e) {
+        // no-op
+      }
+      if (!cancelled && refreshMs > 0) timer = setTimeout(refresh, refreshMs);
+    }
+
+    // Only points added or moved since the last cursor are fetched and merged by id
+    async function refresh() {
+      polls += 1;
+      if (fullRefreshEvery > 0 && polls % fullRefreshEvery === 0) {
+        await load();
+        return;
+      }
       try {
-        const pts = await getEmbeddingPointsAsync(limit);
-        setPoints(pts);
+        const byId = new Map<string, EmbeddingPoint>();
+        let more = true;
+        for (let page = 0; more && page < 5 && !cancelled; page++) {
+          const res = await getEmbeddingPointsPageAsync({ limit, since: cursor.current, model: model.current });
+          res.points.forEach((p) => byId.set(p.id, p));
+          cursor.current = res.cursor;
+          more = res.more;
+        }
+        if (!cancelled && byId.size) {
+          setPoints((prev) => {
+            const merged = prev.map((p) => byId.get(p.id) ?? p);
+            const seen = new Set(prev.map((p) => p.id));
+            byId.forEach((p, id) => {
+              if (!seen.has(id)) merged.push(p);
+            });
+            return merged;
+          });
+        }
       } catch (e) {
         // no-op
       }
-    })();
-  }, [providedPoints, limit]);
+      if (!cancelled && refreshMs > 0) timer = setTimeout(refresh, refreshMs);
+    }
+
+    model.current = undefined;
+    load();
+    return () => {
+      cancelled = true;
+      if (timer) clearTimeout(timer);
+    };
+  }, [providedPoints, limit, maxPoints, refreshMs, fullRefreshEvery]);
 
   const bounds = useMemo(() => (points.length ? normBounds(points) : { minX: -1, maxX: 1, minY: -1, maxY: 1 }), [points]);
   const pad = 8;
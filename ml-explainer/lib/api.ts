@@ -38,10 +38,14 @@ function currentBase(): string {
 }
 
 export type TopKItem = { label: string; p: number };
-export type Neighbor = { x: number; y: number; thumb: string; label: string };
+export type Neighbor = { x: number; y: number; thumb_id?: string | null; thumb_url?: string | null; label: string };
+// Compact Grad-CAM payload (heatmap_format=grid): row-major uint8 values, base64-encoded.
+// With heatmap_classes > 1, `data` holds `k` consecutive grids, one per top-k class in order.
+export type HeatmapGrid = { w: number; h: number; k?: number; encoding: 'u8'; data: string; image_w?: number; image_h?: number };
 export type AnalysisResponse = {
   topk: TopKItem[];
-  heatmap_png_b64: string;
+  heatmap_png_b64: string | null;
+  heatmap_grid?: HeatmapGrid | null;
   embedding: { x: number; y: number };
   neighbors: Neighbor[];
   id: string;
@@ -50,7 +54,7 @@ export type AnalysisResponse = {
 
 export async function analyzeImageAsync(
   uri: string,
-  opts?: string | { user?: string; model?: string; signal?: AbortSignal; timeoutMs?: number }
+  opts?: string | { user?: string; model?: string; signal?: AbortSignal; timeoutMs?: number; heatmapFormat?: 'png' | 'grid'; heatmapClasses?: number }
 ): Promise<AnalysisResponse> {
   const filename = uri.split('/').pop() || 'image.jpg';
   const fallbackType = filename.toLowerCase().endsWith('.png') ? 'image/png' : 'image/jpeg';
@@ -59,6 +63,8 @@ export async function analyzeImageAsync(
   let model: string | undefined;
   let signal: AbortSignal | undefined;
   let timeoutMs: number | undefined;
+  let heatmapFormat: 'png' | 'grid' | undefined;
+  let heatmapClasses: number | undefined;
   if (typeof opts === 'string') {
     user = opts;
   } else if (opts) {
@@ -66,6 +72,8 @@ export async function analyzeImageAsync(
     model = opts.model;
     signal = opts.signal;
     timeoutMs = opts.timeoutMs;
+    heatmapFormat = opts.heatmapFormat;
+    heatmapClasses = opts.heatmapClasses;
   }
 
   if (Platform.OS === 'web') {
@@ -84,6 +92,8 @@ export async function analyzeImageAsync(
   }
 
   if (model) form.append('model', model);
+  if (heatmapFormat) form.append('heatmap_format', heatmapFormat);
+  if (heatmapClasses && heatmapClasses > 1) form.append('heatmap_classes', String(heatmapClasses));
 
   const ctrl = new AbortController();
   const compositeSignal = mergeSignals(signal, ctrl.signal);
@@ -223,16 +233,50 @@ export async function resolveApiBase(opts?: { candidates?: string[]; signal?: Ab
   throw new Error('No API base reachable');
 }
 
-export type EmbeddingPoint = { id: string; x: number; y: number; label: string; thumb?: string };
+export type EmbeddingPoint = {
+  id: string;
+  x: number;
+  y: number;
+  label: string;
+  thumb?: string;
+  // Server path of the thumbnail (relative to the API base), fetched separately
+  thumb_url?: string;
+  // With maxPoints downsampling: how many points this one stands for
+  count?: number;
+};
 
-export async function getEmbeddingPointsAsync(limit?: number): Promise<EmbeddingPoint[]> {
-  const base = currentBase();
-  const url = limit ? `${base}/embeddings/points?limit=${encodeURIComponent(String(limit))}` : `${base}/embeddings/points`;
-  const res = await fetch(url);
+export type EmbeddingPointsPage = {
+  points: EmbeddingPoint[];
+  // Pass back as `since` to get only points added or moved after this page
+  cursor: string | null;
+  more: boolean;
+  // Model whose 2D space these points are in; pin it on delta polls
+  model?: string | null;
+};
+
+export async function getEmbeddingPointsPageAsync(opts: {
+  limit?: number;
+  since?: string | null;
+  maxPoints?: number;
+  bbox?: [number, number, number, number];
+  model?: string;
+} = {}): Promise<EmbeddingPointsPage> {
+  const params = new URLSearchParams();
+  if (opts.limit) params.append('limit', String(opts.limit));
+  if (opts.since) params.append('since', opts.since);
+  if (opts.maxPoints) params.append('max_points', String(opts.maxPoints));
+  if (opts.bbox) params.append('bbox', opts.bbox.join(','));
+  if (opts.model) params.append('model', opts.model);
+  const qs = params.toString();
+  const res = await fetch(`${currentBase()}/embeddings/points${qs ? `?${qs}` : ''}`);
   if (!res.ok) {
     const txt = await res.text();
     throw new Error(`Embeddings failed: ${res.status} ${txt}`);
   }
-  const data = (await res.json()) as { points: EmbeddingPoint[] };
-  return data.points ?? [];
+  const data = (await res.json()) as Partial<EmbeddingPointsPage>;
+  return { points: data.points ?? [], cursor: data.cursor ?? null, more: !!data.more, model: data.model ?? null };
+}
+
+export async function getEmbeddingPointsAsync(limit?: number): Promise<EmbeddingPoint[]> {
+  return (await getEmbeddingPointsPageAsync({ limit })).points;
 }
@@ -0,0 +1,96 @@
+import type { HeatmapGrid } from '@/lib/api';
+
+// Colorize a compact CAM grid (uint8, row-major) into a tiny RGBA PNG data URI.
+// Same red colormap as the server overlay: R = v, A = alpha * v. The PNG stays at
+// grid resolution (e.g. 7x7); the Image component upscales it with smoothing.
+
+const CRC_TABLE = (() => {
+  const t = new Uint32Array(256);
+  for (let n = 0; n < 256; n++) {
+    let c = n;
+    for (let k = 0; k < 8; k++) c = c & 1 ? 0xedb88320 ^ (c >>> 1) : c >>> 1;
+    t[n] = c >>> 0;
+  }
+  return t;
+})();
+
+function crc32(bytes: Uint8Array): number {
+  let c = 0xffffffff;
+  for (let i = 0; i < bytes.length; i++) c = CRC_TABLE[(c ^ bytes[i]) & 0xff] ^ (c >>> 8);
+  return (c ^ 0xffffffff) >>> 0;
+}
+
+function adler32(bytes: Uint8Array): number {
+  let a = 1;
+  let b = 0;
+  for (let i = 0; i < bytes.length; i++) {
+    a = (a + bytes[i]) % 65521;
+    b = (b + a) % 65521;
+  }
+  return ((b << 16) | a) >>> 0;
+}
+
+function u32(n: number): number[] {
+  return [(n >>> 24) & 0xff, (n >>> 16) & 0xff, (n >>> 8) & 0xff, n & 0xff];
+}
+
+function chunk(type: string, data: Uint8Array): number[] {
+  const body = new Uint8Array(4 + data.length);
+  for (let i = 0; i < 4; i++) body[i] = type.charCodeAt(i);
+  body.set(data, 4);
+  return [...u32(data.length), ...body, ...u32(crc32(body))];
+}
+
+// zlib stream made of uncompressed ("stored") deflate blocks: no compressor needed
+function zlibStored(raw: Uint8Array): Uint8Array {
+  const out: number[] = [0x78, 0x01];
+  for (let off = 0; off < raw.length || off === 0; off += 65535) {
+    const len = Math.min(65535, raw.length - off);
+    const last = off + len >= raw.length ? 1 : 0;
+    out.push(last, len & 0xff, (len >>> 8) & 0xff, ~len & 0xff, (~len >>> 8) & 0xff);
+    for (let i = 0; i < len; i++) out.push(raw[off + i]);
+    if (last) break;
+  }
+  out.push(...u32(adler32(raw)));
+  return new Uint8Array(out);
+}
+
+function decodeBase64(b64: string): Uint8Array {
+  const bin = atob(b64);
+  const out = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) out[i] = bin.charCodeAt(i);
+  return out;
+}
+
+function encodeBase64(bytes: number[]): string {
+  let bin = '';
+  for (let i = 0; i < bytes.length; i++) bin += String.fromCharCode(bytes[i]);
+  return btoa(bin);
+}
+
+// `index` picks one grid out of a stacked multi-class payload (grid.k > 1)
+export function gridToPngDataUri(grid: HeatmapGrid, alpha = 0.9, index = 0): string {
+  const { w, h } = grid;
+  const k = Math.max(1, grid.k ?? 1);
+  const offset = Math.min(Math.max(0, index), k - 1) * w * h;
+  const values = decodeBase64(grid.data).subarray(offset, offset + w * h);
+  // One filter byte (0 = none) per scanline, then RGBA pixels
+  const raw = new Uint8Array(h * (1 + 4 * w));
+  for (let y = 0; y < h; y++) {
+    const row = y * (1 + 4 * w);
+    for (let x = 0; x < w; x++) {
+      const v = values[y * w + x] ?? 0;
+      const p = row + 1 + 4 * x;
+      raw[p] = v;
+      raw[p + 3] = Math.round(alpha * v);
+    }
+  }
+  const ihdr = new Uint8Array([...u32(w), ...u32(h), 8, 6, 0, 0, 0]);
+  const png = [
+    0x89, 0x50, 0x4e, 0x47, 0x0d, 0x0a, 0x1a, 0x0a,
+    ...chunk('IHDR', ihdr),
+    ...chunk('IDAT', zlibStored(raw)),
+    ...chunk('IEND', new Uint8Array(0)),
+  ];
+  return 'data:image/png;base64,' + encodeBase64(png);
+}